@@ -2,142 +2,278 @@
 
 """
 The code performs basic statistics on the data obtained from performBRIFSverification.py main().
+
+Observations and model values after the initial time are aligned on a common
+1-minute time axis (per-minute means of the observations, model values at their
+own minutes, linear interpolation over the gaps in between), and BIAS, RMSE, CORR
+and the number/coverage of valid samples are computed for all stations at once.
+AIR_PRE is compared to WRF on the WRF axis, SLEV and WTR_PRE to ROMS on the axis
+of the ROMS file the station was read from. The aligned pairs are also kept in
+skill accumulators (*_ACC), which combine exactly over any number of days.
+
+Air pressure and sea level are also verified in the rissaga band: the Welch
+spectra of the aligned series of all stations are estimated in one batch (see
+spectralScores.py) and give the band energy ratio (*_ENERGYRATIO), the error of
+the peak period (*_PEAKERROR, minutes) and the mean coherence (*_COHERENCE); the
+segment spectra are kept in spectral accumulators (*_SPECTRA).
+
+With window=(start,end), only the pairs in [start,end) are scored (streaming
+verification of a long window in chunks): the model series then start at start
+instead of after the initial time, and minutes outside the window are dropped.
+
 External prerequisites:
---pandas, numpy
+--numpy
 
 Author: Matjaz Licer, NIB MBS @socib
 matjaz.licer@mbss.org
 """
 
-import os,sys,re,requests,json, math,pickle
+import os,sys,re,requests,json, math,pickle,warnings
 from sys import exit as q
 from datetime import datetime,timedelta
 import numpy as np
-import pandas as pd
+from skillAccumulator import *
+from spectralScores import *
 
 
-# define class which contains fields (attributes) from fields array:
+# scores computed at each station. *_N is the number of 1-minute samples where both
+# observation and model are valid, *_COVERAGE is its fraction of the 1-minute axis:
+scores = ['AIR_PRE_CORR','AIR_PRE_RMSE','AIR_PRE_BIAS','WTR_PRE_BIAS','WTR_PRE_RMSE','SLEV_RMSE','SLEV_BIAS',\
+'AIR_PRE_N','AIR_PRE_COVERAGE','WTR_PRE_N','WTR_PRE_COVERAGE','SLEV_N','SLEV_COVERAGE',\
+'AIR_PRE_ENERGYRATIO','AIR_PRE_PEAKERROR','AIR_PRE_COHERENCE','SLEV_ENERGYRATIO','SLEV_PEAKERROR','SLEV_COHERENCE']
+
+# skill accumulators (see skillAccumulator.py) and spectral accumulators (see
+# spectralScores.py) of the aligned series at each station, to be combined over many days:
+accumulators = ['AIR_PRE_ACC','WTR_PRE_ACC','SLEV_ACC','AIR_PRE_SPECTRA','SLEV_SPECTRA']
+
+# define class which contains the scores (attributes) of one station:
 class statisticalScores(object):
+	__slots__ = scores+accumulators
 	def __init__(self):
 	# initialize each field (attribute) to []:
-		scores = ['AIR_PRE_CORR','AIR_PRE_RMSE','AIR_PRE_BIAS','WTR_PRE_BIAS','WTR_PRE_RMSE','SLEV_RMSE','SLEV_BIAS']
 		for field in scores:
 			setattr(self,field,np.array([]))
+		for field in accumulators:
+			setattr(self,field,None)
+
+	def __getstate__(self):
+		return dict([(field,getattr(self,field)) for field in scores+accumulators])
 
-def basicStatistics(strdate,sensorType,stations,wrf_t_3days,wrf_p_3days,roms):
+	def __setstate__(self,state):
+		for field in state:
+			setattr(self,field,state[field])
 
-	t_init = datetime.strptime(strdate,'%Y%m%d')
+def basicStatistics(strdate,sensorType,stations,wrf_t_3days,wrf_p_3days,roms,window=None):
 
-	statsOut = np.array([])
+	t_init = np.datetime64(datetime.strptime(strdate,'%Y%m%d'),'s')
+	if window is not None:
+		# score the pairs in [start,end) only, model values from start on:
+		window = (np.datetime64(window[0],'s'),np.datetime64(window[1],'s'))
+		t_init = window[0]-np.timedelta64(1,'s')
+	nstations = len(stations)
 
 	print "\nComputing statistics..."
-	for i,station in enumerate(stations):
 
-		print "... at station: ",station.location
-		# create Pandas dataframes to be used for analyses:
-		romsData = pd.DataFrame(columns=['romsTimes','romsElevs'])
-		wrfData = pd.DataFrame(columns=['wrfTimes','wrfPressures'])
-		stationData = pd.DataFrame(columns=['stationTimes','AIR_PRE','SLEV','WTR_PRE'])
-
-		# fill Times:
-		romsData['romsTimes'] = [datetime.strptime(t,"%Y%m%d%H%M") for t in roms[i].ocean_time if datetime.strptime(t,"%Y%m%d%H%M") > t_init]
-		wrfData['wrfTimes'] = [datetime.strptime(t,"%Y-%m-%d_%H:%M:00") for t in wrf_t_3days if datetime.strptime(t,"%Y-%m-%d_%H:%M:00") > t_init]
-		stationData['stationTimes'] = [datetime.strptime(t,"%Y%m%d%H%M") for t in station.time if datetime.strptime(t,"%Y%m%d%H%M") > t_init]
-
-		# fill ROMS elevations and
-		# -resample in time to 1 minute resolution
-		# -interpolate over NaN:
-		if len(roms[i].pointSSH)>0:
-			# romsE = roms[i].pointSSH
-			romsE = [e for k,e in enumerate(roms[i].pointSSH) if datetime.strptime(roms[i].ocean_time[k],"%Y%m%d%H%M") > t_init]
-			romsE[romsE>1e4]=np.nan
-			romsData['romsElevs'] = romsE
-			romsData = romsData.set_index(['romsTimes'])
-			romsData = romsData.resample('Min').interpolate()
-
-		# fill WRF pressures and
-		# -resample in time to 1 minute resolution
-		# -interpolate over NaN:
-		wrfData['wrfPressures'] = [p for k,p in enumerate(wrf_p_3days[i,:]) if datetime.strptime(wrf_t_3days[k],"%Y-%m-%d_%H:%M:00") > t_init]
-		wrfData = wrfData.set_index(['wrfTimes'])
-		wrfData = wrfData.resample('Min').interpolate()
-
-		# fill stations data and
-		# -resample in time to 1 minute resolution
-		# -interpolate over NaN:
-		if len(station.WTR_PRE)>0:
-			stationData['WTR_PRE'] = [p for k,p in enumerate(station.WTR_PRE) if datetime.strptime(station.time[k],"%Y%m%d%H%M") > t_init]
-		if len(station.SLEV)>0:
-			stationData['SLEV'] = [e for k,e in enumerate(station.SLEV) if datetime.strptime(station.time[k],"%Y%m%d%H%M") > t_init]
-		if len(station.AIR_PRE)>0:
-			stationData['AIR_PRE']=[p for k,p in enumerate(station.AIR_PRE) if datetime.strptime(station.time[k],"%Y%m%d%H%M") > t_init]
-
-		stationData = stationData.set_index(['stationTimes'])
-		stationData = stationData.resample('Min')
-
-		# do stuff with data:
-#		print station.AIR_PRE
-#		print allNANs(station.AIR_PRE)
-		if len(station.AIR_PRE)>0 and not allNANs(station.AIR_PRE):
-#			print "A ", station.AIR_PRE
-#			print "B ",allNANs(station.AIR_PRE)
-			# crop stationData to wrfData and interpolate over NANs:
-			stationDataWRF = stationData.reindex(wrfData.index).interpolate()
-			# join both datasets:
-			merged = pd.concat([stationDataWRF.interpolate(),wrfData.interpolate()],axis=1)
-			# compute air pressure correlations:
-			AIR_PRE_CORR = merged.corr()
-			# compute BIAS, RMSE:
-			AIR_PRE_BIAS, AIR_PRE_RMSE = biasRMSE(stationDataWRF['AIR_PRE'],wrfData['wrfPressures'])
-			APC = AIR_PRE_CORR['AIR_PRE']['wrfPressures']
-		else:
-			AIR_PRE_BIAS = AIR_PRE_RMSE = APC = np.array([])
+	# which scores can be computed at each station:
+	airOK = np.array([len(station.AIR_PRE)>0 and not allNANs(station.AIR_PRE) for station in stations],dtype=bool)
+	slevOK = np.array([len(station.SLEV)>0 and not allNANs(station.SLEV) for station in stations],dtype=bool)
+	wtrOK = np.array([len(station.WTR_PRE)>0 and not allNANs(station.WTR_PRE) for station in stations],dtype=bool)
 
-			# print "IN:",station.location,APC,AIR_PRE_RMSE,AIR_PRE_BIAS
+	# score arrays of all stations (NaN where not computed):
+	results = dict([(field,np.full(nstations,np.nan)) for field in scores])
+	# skill accumulators of all stations (None where not computed):
+	for field in accumulators:
+		results[field] = np.empty(nstations,dtype=object)
 
-		if len(station.WTR_PRE)>0 and not allNANs(station.WTR_PRE) and not allNANs(romsData['romsElevs']):
-			# crop stationData to wrfData:
-			stationDataROMS = stationData.reindex(romsData.index).interpolate()
-			merged = pd.concat([stationDataROMS.interpolate(),romsData.interpolate()],axis=1)
-			WTR_PRE_BIAS, WTR_PRE_RMSE = biasRMSE(removeMean(stationDataROMS['WTR_PRE']),romsData['romsElevs'])
-		else:
-			WTR_PRE_BIAS = WTR_PRE_RMSE = np.array([])
+	# air pressure: observations and WRF on the common 1-minute WRF axis, all stations at once:
+	axis = minuteAxis(wrf_t_3days,t_init)
+	if axis is not None:
+		t0,nminutes = axis
+		wrfAfter = wrf_t_3days > t_init
+		model = onMinuteAxis(np.array(wrf_p_3days,dtype=float)[:,wrfAfter],wrf_t_3days[wrfAfter],t0,nminutes)
+		obs,nwindow = inWindow(stationsOnMinuteAxis(stations,'AIR_PRE',t_init,t0,nminutes),t0,window)
+		setScores(results,'AIR_PRE',np.arange(nstations),obs,model,['BIAS','RMSE','CORR'],nwindow)
+		setSpectralScores(results,'AIR_PRE',np.arange(nstations),obs,model)
 
+	# sea level and water pressure: observations and ROMS on the 1-minute axis of each ROMS
+	# file, all stations read from the same file at once:
+	romsOK = np.zeros(nstations,dtype=bool)
+	for table,members in romsGroups(roms):
+		t = roms[members[0]].ocean_time
+		romsAfter = t > t_init
+		ssh = np.array(table.matrix('pointSSH'),dtype=float)[:,romsAfter][[roms[k].row for k in members]]
+		ssh[ssh>1e4] = np.nan
+		romsOK[members] = ~allNANs(ssh,axis=1)
+		axis = minuteAxis(t,t_init)
+		if axis is None:
+			continue
+		t0,nminutes = axis
+		model = onMinuteAxis(ssh,t[romsAfter],t0,nminutes)
+		obs,nwindow = inWindow(stationsOnMinuteAxis(stations[members],'SLEV',t_init,t0,nminutes),t0,window)
+		setScores(results,'SLEV',members,obs,model,['BIAS','RMSE'],nwindow)
+		setSpectralScores(results,'SLEV',members,obs,model)
+		# water pressure is compared to sea level without its mean:
+		obs,nwindow = inWindow(stationsOnMinuteAxis(stations[members],'WTR_PRE',t_init,t0,nminutes),t0,window)
+		setScores(results,'WTR_PRE',members,removeMean(obs),model,['BIAS','RMSE'],nwindow)
 
-		if len(station.SLEV)>0  and not allNANs(station.SLEV) and not allNANs(romsData['romsElevs']):
-			# crop stationData to wrfData:
-			stationDataROMS = stationData.reindex(romsData.index).interpolate()
-			merged = pd.concat([stationDataROMS.interpolate(),romsData.interpolate()],axis=1)
-			SLEV_BIAS, SLEV_RMSE = biasRMSE(stationDataROMS['SLEV'],romsData['romsElevs'])
-		else:
-			SLEV_BIAS = SLEV_RMSE = np.array([])
+	computed = {'AIR_PRE':airOK,'SLEV':slevOK & romsOK,'WTR_PRE':wtrOK & romsOK}
 
+	statsOut = np.empty(nstations,dtype=object)
+	for i,station in enumerate(stations):
+		print "... at station: ",station.location
 		stats = statisticalScores()
-		setattr(stats,'AIR_PRE_BIAS',AIR_PRE_BIAS)
-		setattr(stats,'AIR_PRE_RMSE',AIR_PRE_RMSE)
-		setattr(stats,'AIR_PRE_CORR',APC)
-		setattr(stats,'WTR_PRE_BIAS',WTR_PRE_BIAS)
-		setattr(stats,'WTR_PRE_RMSE',WTR_PRE_RMSE)
-		setattr(stats,'SLEV_BIAS',SLEV_BIAS)
-		setattr(stats,'SLEV_RMSE',SLEV_RMSE)
-
-		statsOut = np.append(statsOut,stats)
+		for field in scores:
+			# scores that cannot be computed at this station are left empty:
+			if computed[field.rsplit('_',1)[0]][i]:
+				value = results[field][i].item()
+				setattr(stats,field,int(value) if field.endswith('_N') else value)
+		for field in accumulators:
+			if computed[field.rsplit('_',1)[0]][i]:
+				setattr(stats,field,results[field][i])
+		statsOut[i] = stats
 	return statsOut
 
-def biasRMSE(y1,y2):
-	return np.nanmean([y1[i] - y2[i] for i,v in enumerate(y1)]),\
-	np.sqrt(np.nanmean([(y1[i] - y2[i])**2 for i,v in enumerate(y1)]))
+def minuteAxis(t,t_init):
+	# start and length of the 1-minute axis spanning the times after t_init, or None:
+	after = t[t > t_init]
+	if len(after)==0:
+		return None
+	t0 = after[0].astype('datetime64[m]').astype('datetime64[s]')
+	return t0,int((after[-1]-t0)/np.timedelta64(60,'s'))+1
+
+def minuteMeans(rows,times,values,nrows,t0,nminutes):
+	# (nrows,nminutes) array of the mean of the samples falling into each minute of the
+	# axis starting at t0 (NaN where there are none). rows,times,values are flat arrays:
+	minute = np.floor((times-t0)/np.timedelta64(60,'s')).astype(int)
+	use = (minute>=0) & (minute<nminutes) & ~np.isnan(values)
+	flat = rows[use]*nminutes+minute[use]
+	sums = np.bincount(flat,weights=values[use],minlength=nrows*nminutes)
+	counts = np.bincount(flat,minlength=nrows*nminutes)
+	with np.errstate(invalid='ignore',divide='ignore'):
+		means = sums/counts
+	return means.reshape((nrows,nminutes))
+
+def fillRows(y):
+	# linear interpolation over the NaNs of each row of y (rows on an equally spaced axis);
+	# trailing NaNs take the last valid value and leading NaNs are kept:
+	nrows,n = y.shape
+	valid = ~np.isnan(y)
+	position = np.arange(n)
+	previous = np.maximum.accumulate(np.where(valid,position,-1),axis=1)
+	following = np.minimum.accumulate(np.where(valid,position,n)[:,::-1],axis=1)[:,::-1]
+	rowIndex = np.arange(nrows)[:,None]
+	y0 = y[rowIndex,np.maximum(previous,0)]
+	y1 = y[rowIndex,np.minimum(following,n-1)]
+	gap = following-previous
+	with np.errstate(invalid='ignore',divide='ignore'):
+		filled = np.where(following<n,y0+(y1-y0)*(position-previous)/gap,y0)
+	filled[valid] = y[valid]
+	filled[previous<0] = np.nan
+	return filled
+
+def onMinuteAxis(values,times,t0,nminutes):
+	# (nrows,ntimes) series with common times on the 1-minute axis, NaNs interpolated:
+	nrows,ntimes = values.shape
+	rows = np.repeat(np.arange(nrows),ntimes)
+	return fillRows(minuteMeans(rows,np.tile(times,nrows),values.ravel(),nrows,t0,nminutes))
+
+def stationsOnMinuteAxis(stations,field,t_init,t0,nminutes):
+	# observed field after t_init of all stations, as minute means on the 1-minute axis
+	# with NaNs interpolated, one row per station:
+	rows,times,values = [],[],[]
+	for k,station in enumerate(stations):
+		y = getattr(station,field)
+		if len(y)==0:
+			continue
+		after = station.time > t_init
+		rows.append(np.full(np.count_nonzero(after),k,dtype=int))
+		times.append(station.time[after])
+		values.append(np.array(y,dtype=float)[after])
+	if not rows:
+		return np.full((len(stations),nminutes),np.nan)
+	means = minuteMeans(np.concatenate(rows),np.concatenate(times),np.concatenate(values),len(stations),t0,nminutes)
+	return fillRows(means)
+
+def romsGroups(roms):
+	# group stations by the ROMS file (modelTable) they were read from, stations outside
+	# the ROMS domains excluded:
+	groups = []
+	for k,r in enumerate(roms):
+		if r.row is None:
+			continue
+		for table,members in groups:
+			if table is r.table:
+				members.append(k)
+				break
+		else:
+			groups.append((r.table,[k]))
+	return [(table,np.array(members)) for table,members in groups]
+
+def inWindow(obs,t0,window):
+	# obs on the 1-minute axis starting at t0 with the minutes outside window set to NaN,
+	# and the number of minutes of the axis in the window (all minutes without window):
+	if window is None:
+		return obs,obs.shape[1]
+	minutes = t0+np.arange(obs.shape[1])*np.timedelta64(60,'s')
+	outside = (minutes<window[0]) | (minutes>=window[1])
+	obs = np.array(obs,dtype=float)
+	obs[:,outside] = np.nan
+	return obs,int(np.count_nonzero(~outside))
+
+def setScores(results,variable,members,obs,model,names,nminutes=None):
+	# batched scores of obs against model (rows = stations members) into results;
+	# coverage is relative to nminutes (default: the whole axis):
+	bias,rmse,corr,n = rowScores(obs,model)
+	values = {'BIAS':bias,'RMSE':rmse,'CORR':corr}
+	for name in names:
+		results[variable+'_'+name][members] = values[name]
+	results[variable+'_N'][members] = n
+	nminutes = obs.shape[1] if nminutes is None else nminutes
+	with np.errstate(invalid='ignore',divide='ignore'):
+		results[variable+'_COVERAGE'][members] = n/float(nminutes) if nminutes else np.nan
+	acc = skillAccumulator.fromSeries(obs,model)
+	for row,k in enumerate(members):
+		results[variable+'_ACC'][k] = acc[row]
+
+def setSpectralScores(results,variable,members,obs,model):
+	# batched rissaga band scores of obs against model (rows = stations members) into results:
+	spec = spectralAccumulator.fromSeries(obs,model)
+	energyRatio,peakError,coherence = spec.scores()
+	results[variable+'_ENERGYRATIO'][members] = energyRatio
+	results[variable+'_PEAKERROR'][members] = peakError
+	results[variable+'_COHERENCE'][members] = coherence
+	for row,k in enumerate(members):
+		results[variable+'_SPECTRA'][k] = spec[row]
+
+def rowScores(y1,y2):
+	# BIAS, RMSE, CORR (over samples valid in both) and the number of such samples, per row:
+	valid = ~np.isnan(y1) & ~np.isnan(y2)
+	n = np.sum(valid,axis=1).astype(float)
+	with np.errstate(invalid='ignore',divide='ignore'):
+		bias,rmse = biasRMSE(y1,y2,axis=1)
+		a = np.where(valid,y1,0.)
+		b = np.where(valid,y2,0.)
+		da = np.where(valid,a-(np.sum(a,axis=1)/n)[:,None],0.)
+		db = np.where(valid,b-(np.sum(b,axis=1)/n)[:,None],0.)
+		corr = np.sum(da*db,axis=1)/np.sqrt(np.sum(da**2,axis=1)*np.sum(db**2,axis=1))
+	return bias,rmse,corr,n
+
+def biasRMSE(y1,y2,axis=None):
+	d = np.asarray(y1,dtype=float)-np.asarray(y2,dtype=float)
+	with warnings.catch_warnings():
+		# (all-NaN rows give NaN scores):
+		warnings.simplefilter('ignore',RuntimeWarning)
+		return np.nanmean(d,axis=axis),np.sqrt(np.nanmean(d**2,axis=axis))
 
-def allNANs(y):
-	y=np.array(y)
-	ynn = [yy for i,yy in enumerate(y) if not np.isnan(y[i])]
-	if len(ynn)>0:
-		return False
-	else:
-		return True
+def allNANs(y,axis=None):
+	return ~np.any(~np.isnan(np.asarray(y,dtype=float)),axis=axis)
 
 def removeMean(y):
-	return y-np.nanmean(y)
+	# remove the mean of each row (of the whole series for 1-D y):
+	y = np.asarray(y,dtype=float)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore',RuntimeWarning)
+		return y-np.nanmean(y,axis=-1)[...,None] if y.ndim>1 else y-np.nanmean(y)
 
 if __name__=='__main__':
 	main()
@@ -0,0 +1,224 @@
+#!/usr/bin/python
+"""
+Benchmark of the BRIFS verification stages on synthetic data (see syntheticData.py),
+without access to the BRIFS archive or the SOCIB servers.
+
+The synthetic WRF, ROMS and station files are written to a work directory, the
+station files are served by a local HTTP stand-in of DataDiscovery/THREDDS, and the
+stages of performBRIFSverification.py are run and timed one by one:
+
+getAllObservations, obsData.read, readWRF, readROMS, mergeWRF, basicStatistics, plotBRIFS
+
+and then the range driver (verifyDates) verifies all synthetic dates with a pool of
+workers, starting from empty caches, as a backfill run does.
+
+For each stage, wall and CPU time (including worker processes), throughput and the
+resident memory of this process (at the start, peak during the stage and the growth
+of the stage) and the peak of its workers during the stage are reported (see
+runReport.py). The
+stand-in server answers DataDiscovery and the .dds probes of getAllObservations;
+the discovered files are then read from disk, since it does not speak OpenDAP.
+
+INPUT (all optional), for example:
+
+./benchmarkBRIFS.py --stations 20 --wrf-grid 240x300 --roms-grid 400x400 --window 168 --days 3 --workers 4 --json benchmark.json
+
+--stations: number of stations
+--wrf-grid,--roms-grid,--child-grid: grid sizes NYxNX
+--window: verification window (ROMS output and observations) [hours]
+--days: number of verification dates of the range driver stage
+--workers: number of parallel workers (reads, figures)
+--dir: work directory (a temporary directory, removed afterwards, by default)
+--json: write the report to this JSON file as well
+
+OUTPUT:
+--table of stages with wall time [s], CPU time [s], throughput, memory of the stage,
+	peak memory of the stage and peak memory of its workers [MB]
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import os,sys,time,json,shutil,tempfile,threading,argparse,urllib
+import SimpleHTTPServer,SocketServer
+from datetime import datetime,timedelta
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.image import imsave
+import concurrentFetch
+import gridIndex as gridIndexModule
+import gridInterpolation,romsNests
+from syntheticData import *
+from getAllObservations import *
+from obsData import *
+from modelData import *
+from mergeWRF import *
+from basicStatistics import *
+import plotBRIFS as brifsPlots
+import performBRIFSverification
+import runReport
+from runReport import cpuSeconds,memory,memoryFields
+
+# date of the synthetic verification:
+benchmarkDate = '20160331'
+
+class standInHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+	# serves files below wwwdir, ignoring query strings:
+	wwwdir = '.'
+	def translate_path(self,path):
+		path = urllib.unquote(path.split('?',1)[0].split('#',1)[0])
+		return os.path.join(self.wwwdir,path.lstrip('/'))
+
+	def log_message(self,format,*args):
+		pass
+
+def startStandInServer(wwwdir):
+	# DataDiscovery/THREDDS stand-in on a free local port; returns server and its URL:
+	standInHandler.wwwdir = wwwdir
+	SocketServer.TCPServer.allow_reuse_address = True
+	server = SocketServer.ThreadingTCPServer(('127.0.0.1',0),standInHandler)
+	server.daemon_threads = True
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	return server,'http://127.0.0.1:%d/' % server.server_address[1]
+
+def runStage(report,name,func,args,count=None,unit=''):
+	# run and time one stage; count(result) is the number of units processed:
+	wall0 = time.time()
+	cpu0 = cpuSeconds()
+	nitems = len(runReport.report.items)
+	memory.start()
+	try:
+		result = func(*args)
+	finally:
+		startMB,peakMB = memory.stop()
+	wall = time.time()-wall0
+	entry = {'stage':name,'wall':wall,'cpu':cpuSeconds()-cpu0}
+	entry.update(memoryFields(startMB,peakMB,runReport.report.items[nitems:]))
+	if count is not None:
+		entry['count'] = count(result)
+		entry['unit'] = unit
+		entry['throughput'] = entry['count']/wall if wall>0 else float('inf')
+	report['stages'].append(entry)
+	return result
+
+def printReport(report):
+	print ""
+	print "BRIFS benchmark:",json.dumps(report['config'],sort_keys=True)
+	print "%-20s %9s %9s %22s %10s %10s %12s" % ('stage','wall [s]','cpu [s]','throughput','stage [MB]','peak [MB]','workers [MB]')
+	megabytes = lambda value: '%.1f' % value if value is not None else '-'
+	for entry in report['stages']:
+		throughput = '%10.1f %-11s' % (entry['throughput'],entry['unit']+'/s') if 'count' in entry else ''
+		print "%-20s %9.3f %9.3f %22s %10s %10s %12s" % (entry['stage'],entry['wall'],entry['cpu'],throughput,\
+		megabytes(entry['stageMB']),megabytes(entry['stagePeakMB']),megabytes(entry['workersPeakMB']))
+	print "%-20s %9.3f" % ('total',sum([entry['wall'] for entry in report['stages']]))
+
+def parseGrid(text):
+	ny,nx = text.lower().split('x')
+	return int(ny),int(nx)
+
+def verifyRange(fixture,workdir,serverURL,nworkers):
+	# verify all synthetic dates with the range driver of performBRIFSverification.py and
+	# nworkers processes, with empty caches. Returns the number of verified dates:
+	verification = performBRIFSverification
+	verification.cachedir = os.path.join(workdir,'rangeCache')+'/'
+	verification.checkpointdir = verification.cachedir+'checkpoints/'
+	verification.scoreFile = os.path.join(workdir,'scores.sqlite')
+	verification.setDirectories = lambda strdate,operMode: (fixture['wrfdirs'][strdate],fixture['romsdir'],\
+	os.path.join(workdir,'plots',strdate+'_'+operMode)+'/')
+	# (discovery through the stand-in server, files read from disk):
+	verification.getAllObservations = lambda strdate,hours,nworkers: \
+	[url.replace(serverURL,fixture['wwwdir']+'/') for url in getAllObservations(strdate,hours,nworkers)]
+	for loaded in [gridIndexModule.loadedIndices,gridInterpolation.loadedInterpolators,romsNests.loadedFootprints]:
+		loaded.clear()
+	dates = [datetime.strptime(strdate,'%Y%m%d') for strdate in sorted(fixture['wrfdirs'])]
+	skipped = verification.verifyDates(dates,['oper'],nworkers,min(nworkers,len(dates)))
+	if skipped['oper']:
+		raise RuntimeError('benchmarkBRIFS: dates not verified: '+str(skipped['oper']))
+	return len(dates)
+
+def benchmark(workdir,nstations,wrfShape,romsShape,childShape,windowHours,nworkers,ndays=2):
+	report = {'config':{'stations':nstations,'wrfGrid':wrfShape,'romsGrid':romsShape,'childGrid':childShape,\
+	'windowHours':windowHours,'workers':nworkers,'days':ndays},'stages':[]}
+
+	# synthetic archive and station files:
+	fixture = runStage(report,'syntheticData',syntheticData(workdir,benchmarkDate,nstations,\
+	wrfShape,romsShape,childShape,windowHours,ndays).write,())
+	cachedir = os.path.join(workdir,'cache')+'/'
+	plotdir = os.path.join(workdir,'plots')+'/'
+	makedirs(plotdir)
+	brifsPlots.socibLogoFile = os.path.join(workdir,'logo.png')
+	imsave(brifsPlots.socibLogoFile,np.random.RandomState(0).rand(60,200,3))
+
+	# point the observation stage to the stand-in server:
+	server,serverURL = startStandInServer(fixture['wwwdir'])
+	writeDiscovery(fixture['wwwdir'],fixture['fileList'],serverURL)
+	concurrentFetch.dataDiscoveryURL = serverURL+'list-platforms'
+	concurrentFetch.threddsURL = serverURL+'thredds/dodsC/'
+
+	strdate = benchmarkDate
+	startdatenum = datetime.strptime(strdate,'%Y%m%d')
+	obsenddatenum = startdatenum+timedelta(hours=max(windowHours,60))
+	days = performBRIFSverification.wrfDays(startdatenum)
+
+	try:
+		urls = runStage(report,'getAllObservations',getAllObservations,(strdate,windowHours,nworkers),len,'files')
+		# read the discovered files from disk:
+		fileList = [url.replace(serverURL,fixture['wwwdir']+'/') for url in urls]
+		sensorType = []
+		for fname in fileList:
+			m = re.findall(r'.*_(\w+-\w+.?)_L1',fname)
+			sensorType.append('' if 'station' in m[0] else m[0])
+
+		stations,sensorType = runStage(report,'obsData.read',\
+		obsData(fileList,sensorType,performBRIFSverification.observationFields,startdatenum,obsenddatenum,None,nworkers).read,(),\
+		lambda result: sum([len(station.time) for station in result[0]]),'samples')
+
+		model = modelData(stations,startdatenum,performBRIFSverification.wrfFields,performBRIFSverification.romsFields,\
+		fixture['wrfdirs'][strdate],fixture['romsdir'],'oper',cachedir)
+		wrf_yesterday,wrf_today,wrf_tomorrow = runStage(report,'readWRF',model.readWRFdays,(days,),len,'files')
+		roms = runStage(report,'readROMS',model.readROMS,(startdatenum,'oper'),len,'stations')
+		wrf_t_3days,wrf_p_3days = runStage(report,'mergeWRF',mergeWRF,\
+		(stations,wrf_yesterday,wrf_today,wrf_tomorrow,'pointMSLP'),lambda result: result[1].size,'values')
+		stats = runStage(report,'basicStatistics',basicStatistics,\
+		(strdate,sensorType,stations,wrf_t_3days,wrf_p_3days,roms),len,'stations')
+		runStage(report,'plotBRIFS',brifsPlots.plotBRIFS,\
+		(plotdir,strdate,sensorType,stations,wrf_t_3days,wrf_p_3days,roms,stats,nworkers),\
+		lambda result: len(os.listdir(plotdir)),'figures')
+		runStage(report,'verifyDates',verifyRange,(fixture,workdir,serverURL,nworkers),lambda result: result,'dates')
+	finally:
+		server.shutdown()
+		server.server_close()
+	# I/O and cache records of the run (see runReport.py):
+	report['run'] = runReport.report.summary()
+	return report
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark of the BRIFS verification stages on synthetic data.')
+	parser.add_argument('--stations',type=int,default=10)
+	parser.add_argument('--wrf-grid',default='120x150')
+	parser.add_argument('--roms-grid',default='200x200')
+	parser.add_argument('--child-grid',default='60x60')
+	parser.add_argument('--window',type=int,default=48)
+	parser.add_argument('--days',type=int,default=2)
+	parser.add_argument('--workers',type=int,default=4)
+	parser.add_argument('--dir',default=None)
+	parser.add_argument('--json',default=None)
+	args = parser.parse_args()
+
+	workdir = args.dir if args.dir else tempfile.mkdtemp(prefix='brifsBenchmark')
+	try:
+		report = benchmark(workdir,args.stations,parseGrid(args.wrf_grid),parseGrid(args.roms_grid),\
+		parseGrid(args.child_grid),args.window,args.workers,args.days)
+	finally:
+		if not args.dir:
+			shutil.rmtree(workdir,ignore_errors=True)
+
+	printReport(report)
+	if args.json:
+		with open(args.json,'w') as fp:
+			json.dump(report,fp,indent=1,sort_keys=True)
+
+if __name__=='__main__':
+	main()
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+"""
+Content-hashed checkpoints of the stages of a verification run.
+
+The calls
+
+store = checkpointStore(checkdir)
+key = inputHash(strdate,fileState(files),fields,codeVersion(modules),upstreamKey)
+result = store.run(name,key,func,*args)
+
+run func(*args) as stage name and keep its result (pickled) under the hash key
+of all of its inputs: input files (path, modification time and size), fields,
+the source code of the modules doing the work and the keys of the stages it
+depends on. A later run with the same key loads the result instead of running
+the stage, so a re-run after a crash or after late model output only repeats the
+stages whose inputs changed, and the stages downstream of them. One checkpoint is
+kept per stage and run directory; maxAgeHours limits the reuse of stages whose
+inputs cannot be hashed completely (observations still arriving at the server).
+
+INPUT:
+--checkdir: directory of the checkpoints of one run (e.g. one date and mode)
+--name: stage name
+--key: hash of the stage inputs (see inputHash)
+--func,args: the stage
+--maxAgeHours: (optional) maximum age of a reusable checkpoint
+
+OUTPUT:
+--result: result of func(*args), computed or loaded
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import os,sys,time,pickle,hashlib
+from runReport import report
+
+# code versions already hashed in this run, keyed by module names:
+codeVersions = {}
+
+class checkpointStore(object):
+	def __init__(self,checkdir):
+		self.checkdir = checkdir
+		if not os.path.isdir(self.checkdir):
+			try:
+				os.makedirs(self.checkdir)
+			except OSError:
+				# created concurrently by another process:
+				if not os.path.isdir(self.checkdir):
+					raise
+
+	def filename(self,name):
+		return os.path.join(self.checkdir,name+'.pkl')
+
+	def load(self,name,key,maxAgeHours=None):
+		# result of stage name if its checkpoint has the same key, else None:
+		filename = self.filename(name)
+		if not os.path.isfile(filename):
+			return None
+		if maxAgeHours is not None and time.time()-os.path.getmtime(filename)>maxAgeHours*3600:
+			return None
+		try:
+			with open(filename,'rb') as fp:
+				stored = pickle.load(fp)
+		except Exception:
+			# unreadable (e.g. truncated or corrupt) checkpoint, run the stage again:
+			print "Checkpoint ",filename," is unreadable, stage ",name," is run again."
+			return None
+		if not isinstance(stored,dict) or stored.get('key')!=key:
+			return None
+		return stored
+
+	def save(self,name,key,result):
+		filename = self.filename(name)
+		# (one temporary file per process, the observation checkpoints of a date are shared
+		# by all of its configurations):
+		tmp = filename+'.tmp%d' % os.getpid()
+		with open(tmp,'wb') as fp:
+			pickle.dump({'key':key,'result':result},fp,pickle.HIGHEST_PROTOCOL)
+		os.rename(tmp,filename)
+
+	def run(self,name,key,func,*args,**kwargs):
+		# run stage name, or load its result from the checkpoint of the same key:
+		maxAgeHours = kwargs.get('maxAgeHours')
+		stored = self.load(name,key,maxAgeHours)
+		if stored is not None:
+			print "Stage ",name," is unchanged, loaded from checkpoint ",self.filename(name)
+			report.count('checkpoint','hit')
+			return stored['result']
+		report.count('checkpoint','miss')
+		result = func(*args)
+		self.save(name,key,result)
+		return result
+
+def fileState(files):
+	# path, modification time and size of local files (URLs and missing files by name only):
+	state = []
+	for filename in files:
+		if os.path.isfile(filename):
+			stat = os.stat(filename)
+			state.append((os.path.realpath(filename),stat.st_mtime,stat.st_size))
+		else:
+			state.append((filename,))
+	return state
+
+def codeVersion(modules):
+	# hash of the source files of the named modules:
+	key = tuple(modules)
+	if key not in codeVersions:
+		h = hashlib.sha1()
+		for name in modules:
+			filename = sys.modules[name].__file__
+			if filename.endswith('.pyc'):
+				filename = filename[:-1]
+			with open(filename,'rb') as fp:
+				h.update(fp.read())
+		codeVersions[key] = h.hexdigest()
+	return codeVersions[key]
+
+def inputHash(*parts):
+	# hash of the (repr of the) inputs of a stage:
+	return hashlib.sha1(repr(parts)).hexdigest()
@@ -0,0 +1,111 @@
+#!/usr/bin/python
+"""
+Concurrent fetch layer for SOCIB observation discovery and download.
+
+The calls
+
+session = getSession()
+exists = urlExists(url)
+results = threadMap(func,items,nworkers)
+results = processMap(func,items,nworkers)
+
+provide a shared requests session with a bounded pool of reused HTTP
+connections, a cheap existence probe of OpenDAP URLs (the DAP2 .dds dataset
+descriptor is requested instead of opening the dataset), and bounded parallel
+maps. HTTP requests (DataDiscovery, probes) run in a thread pool; netCDF/OpenDAP
+reads run in a process pool, since the netCDF C library is not thread-safe.
+With nworkers<=1 everything runs serially in the calling process. Every item of
+processMap is timed in the run report (see runReport.py), and the records of the
+pool workers are merged into the report of the calling process. An item that
+fails is reported and its result is None; the other items are still mapped.
+
+Base URLs are taken from the module constants dataDiscoveryURL and threddsURL,
+so the whole observation stage can be pointed to a local stand-in HTTP/OpenDAP
+server.
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import os,requests
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from runReport import report,collectCall,itemLabel
+
+# SOCIB services:
+dataDiscoveryURL = 'http://apps.socib.es/DataDiscovery/list-platforms'
+threddsURL = 'http://thredds.socib.es/thredds/dodsC/'
+
+# maximum number of parallel requests to the SOCIB servers:
+maxConnections = 8
+
+# timeout [s] for HTTP requests:
+httpTimeout = 60
+
+# requests session shared by all threads of this process:
+sessions = {}
+
+def getSession():
+	# one session (and connection pool) per process:
+	pid = os.getpid()
+	if pid not in sessions:
+		session = requests.Session()
+		adapter = requests.adapters.HTTPAdapter(pool_connections=maxConnections,pool_maxsize=maxConnections)
+		session.mount('http://',adapter)
+		session.mount('https://',adapter)
+		sessions[pid] = session
+	return sessions[pid]
+
+def urlExists(url):
+	# test if an OpenDAP URL (or a local netCDF file) exists without opening it:
+	if not url.startswith('http'):
+		return os.path.isfile(url)
+	try:
+		r = getSession().get(url+'.dds',timeout=httpTimeout)
+		report.read(url+'.dds','dds',len(r.content))
+		return r.status_code==200
+	except requests.exceptions.RequestException:
+		return False
+
+def threadMap(func,items,nworkers=maxConnections):
+	# map func over items with at most nworkers threads (for HTTP requests):
+	items = list(items)
+	nworkers = min(nworkers,len(items))
+	if nworkers<=1:
+		return [func(item) for item in items]
+	pool = ThreadPool(nworkers)
+	try:
+		return pool.map(func,items)
+	finally:
+		pool.close()
+		pool.join()
+
+def processMap(func,items,nworkers=maxConnections):
+	# map func over items with at most nworkers processes (for netCDF/OpenDAP reads).
+	# func must be a module-level function and items must be picklable:
+	# Items that fail (exception or sys.exit) give None:
+	items = list(items)
+	nworkers = min(nworkers,len(items))
+	if nworkers<=1:
+		results = []
+		for item in items:
+			try:
+				results.append(report.call(func,item))
+			except (Exception,SystemExit) as e:
+				report.count(func.__name__,'failed')
+				itemFailed(func,item,'%s: %s' % (type(e).__name__,e))
+				results.append(None)
+		return results
+	pool = Pool(nworkers)
+	try:
+		collected = pool.map(collectCall,[(func,item,report.date) for item in items])
+	finally:
+		pool.close()
+		pool.join()
+	for item,(result,records,error) in zip(items,collected):
+		report.merge(records)
+		if error is not None:
+			itemFailed(func,item,error)
+	return [result for result,records,error in collected]
+
+def itemFailed(func,item,error):
+	print "processMap: ",func.__name__," failed for ",itemLabel(item),": ",error
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+"""
+Registry of open netCDF/OpenDAP dataset handles, shared between observation
+discovery and reading.
+
+The calls
+
+exists = registry.probe(url)
+f = registry.open(url)
+registry.closeAll()
+
+probe a URL at most once per run (with a cheap .dds request, see
+concurrentFetch.urlExists, or not at all if the dataset is already open or
+was listed by DataDiscovery) and open each dataset at most once per process,
+so every OpenDAP DDS/DAS round trip is paid once.
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import os
+from netCDF4 import Dataset
+from concurrentFetch import urlExists
+from runReport import report
+
+class datasetRegistry(object):
+	def __init__(self):
+		self.handles = {}
+		self.exists = {}
+		self.pid = os.getpid()
+
+	def checkProcess(self):
+		# handles are not shared with child processes; a forked worker starts afresh:
+		if os.getpid()!=self.pid:
+			self.handles = {}
+			self.pid = os.getpid()
+
+	def known(self,url):
+		# record that url exists (e.g. it was listed by DataDiscovery):
+		self.exists[url] = True
+
+	def probe(self,url):
+		# test if url exists, requesting it at most once per run:
+		self.checkProcess()
+		if url in self.handles or url in self.exists:
+			report.count('registry.probe','hit')
+			return url in self.handles or self.exists[url]
+		report.count('registry.probe','miss')
+		self.exists[url] = urlExists(url)
+		return self.exists[url]
+
+	def open(self,url):
+		# return the open dataset of url, opening it if this is the first request:
+		self.checkProcess()
+		if url in self.handles:
+			report.count('registry.open','hit')
+		else:
+			report.count('registry.open','miss')
+			self.handles[url] = Dataset(url)
+			self.exists[url] = True
+		return self.handles[url]
+
+	def close(self,url):
+		self.checkProcess()
+		if url in self.handles:
+			self.handles.pop(url).close()
+
+	def closeAll(self):
+		self.checkProcess()
+		for url in list(self.handles):
+			self.close(url)
+
+# registry of the current run:
+registry = datasetRegistry()
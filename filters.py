@@ -0,0 +1,89 @@
+#!/usr/bin/python
+"""
+Filters for the station and model time series, with memoized designs.
+
+The calls
+
+y = butter_bandpass_filter(data,lowcut,highcut,fs,order)
+ys = filterBatch(seriesList,lowcut,highcut,fs,order)
+y,delay,n1 = filter_timeseries(pressure)
+
+apply a zero-phase Butterworth band-pass filter (second-order sections, forward
+and backward) to one series or to a 2-D array of series (along the last axis),
+or to a list of series, stacking all series of equal length into one 2-D call.
+Filter coefficients are designed once per (band, sampling rate, order) and
+reused. filter_timeseries is the FIR high-pass filter of the pressure series.
+
+INPUT:
+--data: 1-D series or 2-D array of equally sampled series (one per row)
+--seriesList: list of 1-D series
+--lowcut,highcut: band edges [Hz]
+--fs: sampling frequency [Hz]
+--order: order of the Butterworth filter
+
+OUTPUT:
+--y: filtered data (same shape as data)
+--ys: list of filtered series, in the order of seriesList
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import numpy as np
+from scipy.signal import butter,sosfiltfilt,lfilter,firwin
+
+# filter designs, keyed by their parameters:
+designs = {}
+
+# Charles' filter:
+def filter_timeseries(pressure):
+	# For the filter, it is necessary to set:
+	#  * the cutoff frequency,
+	#  * the filter length,
+	#  * the window applied to the filter
+	n1 = 128  # filter length
+	windowsname = 'blackman'  # windows name
+	sample_rate = 1 / 60.0  # one data per minute
+	nyq_rate = sample_rate / 2.0  # Nyquist rate
+	frqcut = 1.0 / (2000 * 3600.)  # cutoff frequency
+	cutoff = frqcut / nyq_rate  # Cutoff relative to Nyquist rate
+	key = ('fir',n1,cutoff,windowsname)
+	if key not in designs:
+		designs[key] = firwin(n1, cutoff=cutoff, window=(windowsname))
+	# (2-D pressure: one series per row):
+	pressure_filtered = lfilter(designs[key], 1.0, pressure, axis=-1)
+	delay = 0.5 * (n1 - 1) / sample_rate
+	return pressure-pressure_filtered, delay, n1
+
+# Butterworth bandpass filter in second-order sections:
+def butter_bandpass(lowcut, highcut, fs, order):
+	key = ('butter',float(lowcut),float(highcut),float(fs),order)
+	if key not in designs:
+		nyq = 0.5 * fs # Nyquist rate
+		low = lowcut / nyq # Low end cutoff relative to Nyquist rate
+		high = highcut / nyq # High end cutoff relative to Nyquist rate
+		designs[key] = butter(order, [low, high], btype='band', output='sos')
+	return designs[key]
+
+def butter_bandpass_filter(data, lowcut, highcut, fs, order):
+	# zero-phase band-pass filter of data along its last axis:
+	sos = butter_bandpass(lowcut, highcut, fs, order=order)
+	data = np.asarray(data,dtype=float)
+	# default edge padding of sosfiltfilt, limited for short series:
+	padlen = min(3*(2*len(sos)+1),data.shape[-1]-1)
+	return sosfiltfilt(sos, data, axis=-1, padlen=max(padlen,0))
+
+def filterBatch(seriesList, lowcut, highcut, fs, order):
+	# filter a list of 1-D series with the same filter, all series of equal length in one
+	# 2-D call:
+	filtered = [None]*len(seriesList)
+	lengths = [len(y) for y in seriesList]
+	for n in sorted(set(lengths)):
+		members = [k for k,length in enumerate(lengths) if length==n]
+		if n==0:
+			for k in members:
+				filtered[k] = np.array([])
+			continue
+		batch = butter_bandpass_filter(np.vstack([seriesList[k] for k in members]), lowcut, highcut, fs, order)
+		for row,k in enumerate(members):
+			filtered[k] = batch[row]
+	return filtered
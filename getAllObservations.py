@@ -6,14 +6,33 @@ utility.
 INPUT:
 --strdate: string date YYYYMMDD
 --timeWindow: time window for data retrieval in hours, should be: 48
+--nworkers: (optional) maximum number of parallel requests to SOCIB servers
+
+The DataDiscovery request and the existence probes of manually appended stations
+run concurrently over a shared pool of HTTP connections (see concurrentFetch.py).
+Probe results are kept in the dataset registry (see datasetRegistry.py), so no
+URL is requested twice in a run.
 """
 import os,sys,re,requests,json
 from datetime import datetime,timedelta
 from sys import exit as q
 from netCDF4 import Dataset
 import numpy as np
-
-def getAllObservations(strdate, timeWindow):
+from multiprocessing.pool import ThreadPool
+import concurrentFetch
+from concurrentFetch import *
+from datasetRegistry import registry
+from runReport import report
+
+# stations not found by DataDiscovery, appended manually (THREDDS path relative to
+# threddsURL, station_sensor part of the filename):
+manualStations = [\
+	# CIUTADELLA barometer:
+	('mooring/barometer/station_ciutadella-scb_baro005/L1/','/dep0001_station-ciutadella_scb-baro005_L1_'),\
+	# GALFI weather station:
+	('mooring/weather_station/station_galfi-scb_met005/L1/','/dep0001_station-galfi_scb-met005_L1_')]
+
+def getAllObservations(strdate, timeWindow, nworkers=maxConnections):
 
 	# read start date from console:
 	startdatenum = datetime.strptime(strdate,'%Y%m%d')
@@ -25,15 +44,24 @@ def getAllObservations(strdate, timeWindow):
 	enddatestring = datetime.strftime(startdatenum+timedelta(hours=timeWindow),'%Y-%m-%dT000000')
 
 	# construct request string:
-	requestString = 'http://apps.socib.es/DataDiscovery/list-platforms?'+\
+	requestString = concurrentFetch.dataDiscoveryURL+'?'+\
 	'init_datetime='+startdatestring+'&end_datetime='+enddatestring#+\
 	# '&parameter='+parameter
 
-	# request JSON:
-	r = requests.get(requestString)
+	# request JSON in the background, while the manually appended stations are probed:
+	pool = ThreadPool(1)
+	discovery = pool.apply_async(fetchDiscovery,(requestString,))
+
+	# candidate URLs of manually appended stations, probed concurrently:
+	candidates = []
+	for thredds,station_sensor in manualStations:
+		candidates.extend(manualStationCandidates(startdatenum,concurrentFetch.threddsURL+thredds,station_sensor))
+	exists = threadMap(registry.probe,candidates,nworkers)
 
 	# read JSON:
-	allPlatforms = r.json()
+	allPlatforms = discovery.get()
+	pool.close()
+	pool.join()
 
 	# initialize fileList to fill:
 	fileList = []
@@ -47,23 +75,27 @@ def getAllObservations(strdate, timeWindow):
 				if 'mooring' in m[kk] and 'station' in m[kk] and 'L1' in m[kk]:
 					# append URL to fileList if it's a station and L1 product:
 					fileList.append(m[kk])
+					registry.known(m[kk])
 
+	# append manual stations (CIUTADELLA, GALFI) if their files exist:
+	fileList.extend([fname for fname,ok in zip(candidates,exists) if ok])
 
-	# append CIUTADELLA manually:
-	thredds='http://thredds.socib.es/thredds/dodsC/mooring/barometer/station_ciutadella-scb_baro005/L1/'
-	station_sensor = '/dep0001_station-ciutadella_scb-baro005_L1_'
-	fileList = appendStationManually(fileList,startdatenum,thredds,station_sensor)
-
-	# append GALFI manually:
-	thredds='http://thredds.socib.es/thredds/dodsC/mooring/weather_station/station_galfi-scb_met005/L1/'
-	station_sensor = '/dep0001_station-galfi_scb-met005_L1_'
-	fileList = appendStationManually(fileList,startdatenum,thredds,station_sensor)
+	# each URL only once (DataDiscovery may list a manually appended station as well),
+	# so that no file is read twice:
+	uniqueList = []
+	for fname in fileList:
+		if fname not in uniqueList:
+			uniqueList.append(fname)
 
-	return fileList
+	return uniqueList
 
-def appendStationManually(fileList,startdatenum,thredds, station_sensor):
-	# append CIUTADELLA barometer by hand since DataDiscovery does not find it:
+def fetchDiscovery(requestString):
+	# DataDiscovery answer (JSON list of platforms) of requestString:
+	r = getSession().get(requestString,timeout=httpTimeout)
+	report.read(concurrentFetch.dataDiscoveryURL,'list-platforms',len(r.content))
+	return r.json()
 
+def manualStationCandidates(startdatenum,thredds,station_sensor):
 	# construct datestrings for years and months to be inserted into THREDDS url:
 	year_yesterday = datetime.strftime(startdatenum-timedelta(days=1),'%Y')
 	month_yesterday = datetime.strftime(startdatenum-timedelta(days=1),'%m')
@@ -80,15 +112,6 @@ def appendStationManually(fileList,startdatenum,thredds, station_sensor):
 	f_tomorrow = thredds+year_tomorrow+station_sensor+year_tomorrow+'-'+month_tomorrow+'.nc'
 	f_aftertomorrow = thredds+year_aftertomorrow+station_sensor+year_aftertomorrow+'-'+month_aftertomorrow+'.nc'
 
-	# loop over unique filenames - this is done to include different months(years) if neccessary, or to just add one file if
-	# files from ciutadella_yesterday to ciutadella_aftertomorrow are all the same file (i.e. if we are in the middle of the month):
-	for fname in np.unique([f_yesterday,f_today,f_tomorrow,f_aftertomorrow]):
-		try:
-			# try to open ciut_fname URL = test if OpenDAP file exists at ciut_fname URL.
-			Dataset(fname)
-			# append to filelist:
-			fileList.append(fname)
-		except:
-			pass
-
-	return fileList
+	# unique filenames - this is done to include different months(years) if neccessary, or to just add one file if
+	# files from yesterday to aftertomorrow are all the same file (i.e. if we are in the middle of the month):
+	return list(np.unique([f_yesterday,f_today,f_tomorrow,f_aftertomorrow]))
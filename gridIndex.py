@@ -0,0 +1,211 @@
+#!/usr/bin/python
+"""
+Persistent station-to-grid index for WRF and ROMS grids.
+
+The calls
+
+index = gridIndexFromFile(f,'XLONG','XLAT',cachedir)
+i_station,j_station,inside = index.find(stationLon,stationLat)
+
+build (or load from cachedir) a KD-tree of the 2-D lon/lat grid of the netCDF
+file f and return the grid indices of the cell nearest to the station. The
+index is keyed by a hash of the full grid coordinates, so any change of the grid
+gives a new index. The hash is computed once per file and persisted in cachedir,
+keyed by the real path, modification time and size of the file (the URL of a
+remote one) and the coordinate names, so a later run reads no coordinates at all:
+it finds the hash and the index on disk. On a miss, the index is built from the
+arrays read for the hash. Stations farther from
+the nearest cell than one grid spacing lie outside the domain and are returned
+with inside=False.
+
+INPUT:
+--f: open netCDF4 Dataset containing the grid
+--lonName,latName: names of the 2-D (or 3-D with leading time dimension) lon/lat variables
+--cachedir: directory for the persisted indices; None keeps them in memory only
+
+OUTPUT:
+--index: gridIndex object with find(stationLon,stationLat) method, returning
+	row index, column index and inside flag, and distance(stationLon,stationLat)
+	returning the distance to the nearest cell in km.
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import os,pickle,hashlib
+import numpy as np
+from scipy.spatial import cKDTree
+from runReport import report
+
+# mean Earth radius expressed in km per degree of latitude:
+kmPerDegree = 111.195
+
+# indices already loaded in this process, keyed by grid hash:
+loadedIndices = {}
+
+# grid hashes known to this process, keyed by file, modification time, size and
+# coordinate names (see sourceKey):
+gridHashes = {}
+
+class gridIndex(object):
+	def __init__(self,longrid2d,latgrid2d,key):
+		longrid2d = np.array(longrid2d,dtype=float)
+		latgrid2d = np.array(latgrid2d,dtype=float)
+		self.key = key
+		self.shape = longrid2d.shape
+		# scale longitudes with the cosine of the mean latitude, so that
+		# euclidean distances are (approximately) in degrees of latitude:
+		self.coslat = np.cos(np.deg2rad(np.mean(latgrid2d)))
+		self.tree = cKDTree(np.column_stack((longrid2d.ravel()*self.coslat,latgrid2d.ravel())))
+		# grid spacing = largest distance between neighbouring cells:
+		dx = np.hypot(np.diff(longrid2d,axis=1)*self.coslat,np.diff(latgrid2d,axis=1))
+		dy = np.hypot(np.diff(longrid2d,axis=0)*self.coslat,np.diff(latgrid2d,axis=0))
+		self.spacing = max(np.amax(dx),np.amax(dy))
+		# station lookups done so far, keyed by (stationLon,stationLat):
+		self.stations = {}
+
+	def lookup(self,stationLon,stationLat):
+		# return row index, column index and distance [degrees] of the nearest cell:
+		key = (float(stationLon),float(stationLat))
+		if key not in self.stations:
+			distance,k = self.tree.query([key[0]*self.coslat,key[1]])
+			i_station,j_station = np.unravel_index(k,self.shape)
+			self.stations[key] = (int(i_station),int(j_station),float(distance))
+		return self.stations[key]
+
+	def find(self,stationLon,stationLat):
+		i_station,j_station,distance = self.lookup(stationLon,stationLat)
+		return i_station,j_station,distance<=self.spacing
+
+	def distance(self,stationLon,stationLat):
+		# distance of the station to its nearest cell in km:
+		return self.lookup(stationLon,stationLat)[2]*kmPerDegree
+
+def sourceKey(source,lonName,latName):
+	# identity of the grid of source: real path, modification time and size of a local
+	# file (the URL of a remote one) and the coordinate names:
+	if os.path.isfile(source):
+		stat = os.stat(source)
+		return (os.path.realpath(source),stat.st_mtime,stat.st_size,lonName,latName)
+	return (source,lonName,latName)
+
+def gridHashName(key,cachedir):
+	return os.path.join(cachedir,'gridHashes','gridHash_'+hashlib.sha1(repr(key)).hexdigest()+'.txt')
+
+def knownGridHash(source,lonName,latName,cachedir=None):
+	# grid hash of source computed earlier in this process or persisted in cachedir,
+	# without reading any coordinates; None if it is not known:
+	key = sourceKey(source,lonName,latName)
+	if key in gridHashes:
+		return gridHashes[key]
+	if cachedir and os.path.isfile(gridHashName(key,cachedir)):
+		with open(gridHashName(key,cachedir)) as fp:
+			gridHashes[key] = fp.read().strip()
+		return gridHashes[key]
+	return None
+
+def readGrid(f,lonName,latName):
+	# full 2-D lon/lat arrays of the open file f (first time of 3-D variables):
+	grid2d = (0,)*(len(f.variables[lonName].shape)-2)+(slice(None),slice(None))
+	lon = np.ascontiguousarray(f.variables[lonName][grid2d],dtype=float)
+	lat = np.ascontiguousarray(f.variables[latName][grid2d],dtype=float)
+	report.read(f.filepath(),lonName,lon)
+	report.read(f.filepath(),latName,lat)
+	return lon,lat
+
+def gridHashAndGrid(f,lonName,latName,cachedir=None):
+	# hash of the grid shape and of the full coordinate arrays of the open file f, and the
+	# arrays if they had to be read (None,None if the hash was already known):
+	h = knownGridHash(f.filepath(),lonName,latName,cachedir)
+	if h is not None:
+		return h,None,None
+	lon,lat = readGrid(f,lonName,latName)
+	sha = hashlib.sha1()
+	sha.update(str(lon.shape))
+	sha.update(lon.tostring())
+	sha.update(lat.tostring())
+	h = sha.hexdigest()
+	key = sourceKey(f.filepath(),lonName,latName)
+	gridHashes[key] = h
+	saveGridHash(key,h,cachedir)
+	return h,lon,lat
+
+def gridHash(f,lonName,latName,cachedir=None):
+	return gridHashAndGrid(f,lonName,latName,cachedir)[0]
+
+def saveGridHash(key,h,cachedir):
+	# persist the grid hash of the file key to cachedir:
+	if not cachedir:
+		return
+	hashdir = os.path.join(cachedir,'gridHashes')
+	if not os.path.isdir(hashdir):
+		try:
+			os.makedirs(hashdir)
+		except OSError:
+			# created concurrently by another process:
+			if not os.path.isdir(hashdir):
+				raise
+	filename = gridHashName(key,cachedir)
+	# (one temporary file per process, several workers may hash the same file):
+	tmp = filename+'.tmp%d' % os.getpid()
+	with open(tmp,'w') as fp:
+		fp.write(h)
+	try:
+		os.rename(tmp,filename)
+	except OSError:
+		# published concurrently by another process:
+		if os.path.isfile(tmp):
+			os.remove(tmp)
+		if not os.path.isfile(filename):
+			raise
+
+def gridIndexFromFile(f,lonName,latName,cachedir=None):
+	key,lon,lat = gridHashAndGrid(f,lonName,latName,cachedir)
+
+	# already loaded in this run:
+	if key in loadedIndices:
+		report.count('gridIndex','hit')
+		return loadedIndices[key]
+
+	# persisted by an earlier run:
+	if cachedir:
+		picklename = os.path.join(cachedir,'gridIndex_'+key+'.pkl')
+		if os.path.isfile(picklename):
+			with open(picklename,'rb') as fp:
+				index = pickle.load(fp)
+			report.count('gridIndex','hit')
+			loadedIndices[key] = index
+			return index
+
+	# build from the full coordinate arrays (those read for the hash, if any):
+	report.count('gridIndex','miss')
+	if lon is None:
+		lon,lat = readGrid(f,lonName,latName)
+	index = gridIndex(lon,lat,key)
+	loadedIndices[key] = index
+	saveGridIndex(index,cachedir)
+	return index
+
+def saveGridIndex(index,cachedir):
+	# persist the index to cachedir:
+	if not cachedir:
+		return
+	if not os.path.isdir(cachedir):
+		try:
+			os.makedirs(cachedir)
+		except OSError:
+			# created concurrently by another process:
+			if not os.path.isdir(cachedir):
+				raise
+	picklename = os.path.join(cachedir,'gridIndex_'+index.key+'.pkl')
+	# (one temporary file per process, several workers may build the same index):
+	tmp = picklename+'.tmp%d' % os.getpid()
+	with open(tmp,'wb') as fp:
+		pickle.dump(index,fp,pickle.HIGHEST_PROTOCOL)
+	try:
+		os.rename(tmp,picklename)
+	except OSError:
+		# published concurrently by another process:
+		if os.path.isfile(tmp):
+			os.remove(tmp)
+		if not os.path.isfile(picklename):
+			raise
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+"""
+Model-to-station interpolation with precomputed weights, applied as one sparse
+operator per grid.
+
+The calls
+
+interp = gridInterpolatorFromIndex(index,stationLons,stationLats,method)
+cells = interp.read(f,variables)
+W = interp.operator(wet)
+values = W.dot(cells['zeta'])
+
+find, for every station, the 2x2 block of grid cells around it (the block whose
+quadrilateral contains the station, found by inverting the bilinear mapping of
+the curvilinear grid), precompute the weights of its four cells, read the
+[:,i0:i0+2,j0:j0+2] blocks of the requested variables of all stations, and
+interpolate all stations and time steps in one sparse matrix product. Weights of
+dry cells (wet=False, e.g. from mask_rho) are set to zero and the remaining
+weights renormalized; stations with four dry cells keep the value of the nearest
+cell. Weights depend only on the grid and the station coordinates, so they are
+computed once per grid (and station set) and reused.
+
+INPUT:
+--index: gridIndex of the grid (see gridIndex.py)
+--stationLons,stationLats: station coordinates (inside the grid)
+--method: 'bilinear', 'idw' (inverse squared distance of the four cells) or
+	'nearest' (value of the nearest cell)
+--f: open netCDF file of the grid
+--variables: names of the (time,y,x) variables to read
+--wet: (optional) (nstations,4) bool array of the wet cells of each block (see readWet)
+
+OUTPUT:
+--cells: dict of (4*nstations,ntimes) arrays of the block cells, per variable
+--W: (nstations,4*nstations) scipy.sparse.csr_matrix interpolation operator
+--values: (nstations,ntimes) interpolated values
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import numpy as np
+from scipy.sparse import csr_matrix
+from runReport import report
+
+# interpolators already built in this run, keyed by grid, method and stations:
+loadedInterpolators = {}
+
+# Newton iterations of the bilinear inversion and tolerance of the containment test:
+newtonIterations = 8
+insideTolerance = 1.e-6
+
+def gridCoordinates(index):
+	# scaled lon (lon*coslat) and lat 2-D arrays of the grid of index (from its KD-tree):
+	x = index.tree.data[:,0].reshape(index.shape)
+	y = index.tree.data[:,1].reshape(index.shape)
+	return x,y
+
+def invertBilinear(x,y,i0,j0,px,py):
+	# fractional position (s along rows, t along columns) of points (px,py) in the
+	# quadrilaterals with upper-left cells (i0,j0):
+	x00,x01,x10,x11 = x[i0,j0],x[i0,j0+1],x[i0+1,j0],x[i0+1,j0+1]
+	y00,y01,y10,y11 = y[i0,j0],y[i0,j0+1],y[i0+1,j0],y[i0+1,j0+1]
+	s = np.full(np.shape(px),0.5)
+	t = np.full(np.shape(px),0.5)
+	for iteration in range(newtonIterations):
+		fx = (1-s)*(1-t)*x00+(1-s)*t*x01+s*(1-t)*x10+s*t*x11-px
+		fy = (1-s)*(1-t)*y00+(1-s)*t*y01+s*(1-t)*y10+s*t*y11-py
+		dxds = (1-t)*(x10-x00)+t*(x11-x01)
+		dyds = (1-t)*(y10-y00)+t*(y11-y01)
+		dxdt = (1-s)*(x01-x00)+s*(x11-x10)
+		dydt = (1-s)*(y01-y00)+s*(y11-y10)
+		det = dxds*dydt-dxdt*dyds
+		det = np.where(det==0,np.finfo(float).tiny,det)
+		s = s-(dydt*fx-dxdt*fy)/det
+		t = t-(dxds*fy-dyds*fx)/det
+	return s,t
+
+class gridInterpolator(object):
+	def __init__(self,x,y,nearestCells,px,py,method='bilinear'):
+		# x,y: scaled grid coordinates, nearestCells: (n,2) nearest (i,j) of each station,
+		# px,py: scaled station coordinates:
+		ny,nx = x.shape
+		n = len(px)
+		self.method = method
+		px = np.asarray(px,dtype=float)
+		py = np.asarray(py,dtype=float)
+		i = np.asarray(nearestCells[:,0],dtype=int)
+		j = np.asarray(nearestCells[:,1],dtype=int)
+
+		# the four blocks containing the nearest cell; take the first whose quadrilateral
+		# contains the station, or the one it is closest to:
+		candidates = [(np.clip(i-di,0,ny-2),np.clip(j-dj,0,nx-2)) for di in [1,0] for dj in [1,0]]
+		best = np.full(n,np.inf)
+		self.blocks = np.zeros((n,2),dtype=int)
+		s = np.zeros(n)
+		t = np.zeros(n)
+		for i0,j0 in candidates:
+			cs,ct = invertBilinear(x,y,i0,j0,px,py)
+			outside = np.nanmax(np.abs(np.column_stack((cs-np.clip(cs,0,1),ct-np.clip(ct,0,1)))),axis=1)
+			outside = np.where(np.isnan(outside),np.inf,outside)
+			better = outside<best-insideTolerance
+			best = np.where(better,outside,best)
+			self.blocks[better] = np.column_stack((i0,j0))[better]
+			s = np.where(better,cs,s)
+			t = np.where(better,ct,t)
+		s = np.clip(np.nan_to_num(s),0,1)
+		t = np.clip(np.nan_to_num(t),0,1)
+
+		# cells of each block in the order (i0,j0),(i0,j0+1),(i0+1,j0),(i0+1,j0+1):
+		di = np.array([0,0,1,1])
+		dj = np.array([0,1,0,1])
+		self.nearest = (i-self.blocks[:,0])*2+(j-self.blocks[:,1])
+		if method=='bilinear':
+			self.weights = np.column_stack(((1-s)*(1-t),(1-s)*t,s*(1-t),s*t))
+		elif method=='idw':
+			ci = self.blocks[:,0][:,None]+di[None,:]
+			cj = self.blocks[:,1][:,None]+dj[None,:]
+			d2 = (x[ci,cj]-px[:,None])**2+(y[ci,cj]-py[:,None])**2
+			with np.errstate(divide='ignore'):
+				w = 1./d2
+			# a station on a cell takes its value:
+			onCell = np.isinf(w)
+			w = np.where(np.any(onCell,axis=1)[:,None],onCell.astype(float),w)
+			self.weights = w/np.sum(w,axis=1)[:,None]
+		elif method=='nearest':
+			self.weights = np.zeros((n,4))
+			self.weights[np.arange(n),self.nearest] = 1.
+		else:
+			raise ValueError('gridInterpolation: unknown method '+str(method))
+
+	def __len__(self):
+		return len(self.blocks)
+
+	def operator(self,wet=None):
+		# (nstations,4*nstations) sparse operator; weights of dry cells are removed and the
+		# others renormalized (stations without wet cells keep their nearest cell):
+		n = len(self)
+		weights = self.weights
+		if wet is not None:
+			weights = np.where(wet,weights,0.)
+			total = np.sum(weights,axis=1)
+			nearest = np.zeros((n,4))
+			nearest[np.arange(n),self.nearest] = 1.
+			with np.errstate(invalid='ignore',divide='ignore'):
+				weights = np.where((total>0)[:,None],weights/total[:,None],nearest)
+		rows = np.repeat(np.arange(n),4)
+		columns = np.arange(4*n)
+		return csr_matrix((weights.ravel(),(rows,columns)),shape=(n,4*n))
+
+	def read(self,f,variables):
+		# (4*nstations,ntimes) array of the block cells of each (time,y,x) variable:
+		cells = {}
+		for var in variables:
+			v = f.variables[var]
+			out = np.empty((4*len(self),v.shape[0]),dtype=float)
+			for k,(i0,j0) in enumerate(self.blocks):
+				out[4*k:4*k+4] = np.reshape(v[:,i0:i0+2,j0:j0+2],(v.shape[0],4)).T
+			report.read(f.filepath(),var,out)
+			cells[var] = out
+		return cells
+
+	def readWet(self,f,maskName='mask_rho'):
+		# (nstations,4) bool array of the wet cells of each block (all wet without mask):
+		if maskName not in f.variables:
+			return None
+		mask = f.variables[maskName]
+		wet = np.array([np.ravel(mask[i0:i0+2,j0:j0+2]) for i0,j0 in self.blocks],dtype=float).reshape((len(self),4))
+		report.read(f.filepath(),maskName,wet)
+		return wet>0
+
+def gridInterpolatorFromIndex(index,stationLons,stationLats,method='bilinear'):
+	# interpolator of the stations in the grid of index, built once per grid and station set:
+	stationLons = np.asarray(stationLons,dtype=float)
+	stationLats = np.asarray(stationLats,dtype=float)
+	key = (index.key,method,tuple(stationLons),tuple(stationLats))
+	if key not in loadedInterpolators:
+		nearestCells = np.array([index.lookup(lon,lat)[:2] for lon,lat in zip(stationLons,stationLats)],dtype=int).reshape((-1,2))
+		x,y = gridCoordinates(index)
+		loadedInterpolators[key] = gridInterpolator(x,y,nearestCells,stationLons*index.coslat,stationLats,method)
+	return loadedInterpolators[key]
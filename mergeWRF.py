@@ -10,7 +10,7 @@ INPUT:
 	respectively. (today being strdate.)
 
 OUTPUT:
---wrfTimes,wrfPressures: merged 3-day long timeseries of dates and pressures.
+--wrfTimes,wrfPressures: merged 3-day long timeseries of dates (datetime64) and pressures.
 
 Author: Matjaz Licer, NIB MBS @socib
 matjaz.licer@mbss.org
@@ -24,20 +24,12 @@ from sys import exit as q
 
 def mergeWRF(stations,wrf_yesterday,wrf_today,wrf_tomorrow,pressureField):
 
-# numpy.vstack(tup)
-	ntimes = len(wrf_yesterday[0].Times)+len(wrf_today[0].Times)+len(wrf_tomorrow[0].Times)
-
-	# merge Times:
-	wrfTimes = []
-	for wrf in [wrf_yesterday,wrf_today,wrf_tomorrow]:
-		wrfTimes = np.append(wrfTimes,wrf[0].Times)
-
-	# merge pressures for all three days and each station:
-	wrfPressures = np.zeros( (len(stations) , ntimes) )
-	for k in range(len(stations)):
-		tmp_pressure = []
-		for wrf in [wrf_yesterday,wrf_today,wrf_tomorrow]:
-			tmp_pressure = np.append(tmp_pressure, getattr(wrf[k],pressureField))
-		wrfPressures[k,:] = tmp_pressure
+	# merge Times (datetime64):
+	wrfTimes = np.concatenate([wrf[0].Times for wrf in [wrf_yesterday,wrf_today,wrf_tomorrow]])
+
+	# merge pressures for all three days, all stations at once. Each day holds the
+	# stations' values in one (nrows,ntimes) array of its modelTable:
+	wrfPressures = np.hstack([wrf[0].table.matrix(pressureField,[w.row for w in wrf]) \
+	for wrf in [wrf_yesterday,wrf_today,wrf_tomorrow]])
 
 	return wrfTimes,wrfPressures
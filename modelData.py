@@ -5,6 +5,8 @@ Reads WRF and ROMS netCDF files and extracts model values at observational stati
 The calls
 
 wrf_date = modelData(stations,date,wrfFields,romsFields,wrfdir,romsdir).readWRF()
+wrf_days = modelData(stations,date,wrfFields,romsFields,wrfdir,romsdir).readWRFdays(dates)
+wrf_days = modelData(stations,date,wrfFields,romsFields,wrfdir,romsdir).readWRFfiles(wrfFiles)
 roms = modelData(stations,startdatenum,wrfFields,romsFields,wrfdir,romsdir).readROMS()
 
 read available data from the WRF/ROMS netCDFs in wrfdir/romsdir.
@@ -19,8 +21,20 @@ INPUT:
 --romsdir: directory with ROMS netCDFs
 
 OUTPUT:
-wrf_date/roms: stations-long list of modelData objects containing data about the
-wrfFields or romsFields.
+wrf_date/roms: stations-long array of modelAtSensorLocation objects containing data
+about the wrfFields or romsFields. Each is a zero-copy view of one row of a
+modelTable, which holds the values of all stations in (nstations,ntimes) arrays.
+wrf_days: list of such lists, one for each date in dates (or each file in wrfFiles).
+Station grid indices are found once and only the cells around the stations are
+read from each file. Model values are interpolated to the stations from the 2x2
+cells around them with weights precomputed once per grid (see gridInterpolation.py
+and interpolationMethod), ROMS values from wet cells only. WRF point fields are
+diagnostics (see wrfDiagnostics.py); only the raw variables the requested ones
+depend on are read. ROMS stations are read
+from the finest registered nest containing them (see romsNests.py).
+With a cachedir, the series extracted from each file are kept in a memory-mapped
+series cache (see seriesCache.py), so a file is read again only if it changed or
+the stations changed.
 
 Author: Matjaz Licer, NIB MBS @socib
 matjaz.licer@mbss.org
@@ -31,12 +45,71 @@ from datetime import datetime,timedelta
 from netCDF4 import Dataset
 import numpy as np
 from sys import exit as q
-
+from gridIndex import *
+from datasetRegistry import registry
+from timeAxis import *
+from runReport import report
+from romsNests import *
+from gridInterpolation import *
+from seriesCache import seriesCache
+from wrfDiagnostics import *
+
+# interpolation of model fields to the stations (see gridInterpolation.py):
+# 'bilinear', 'idw' or 'nearest' (value of the nearest grid cell):
+interpolationMethod = 'bilinear'
+
+# model values at station locations are held in a modelTable: one array per field
+# with the station (row) as first dimension, e.g. (nstations,ntimes) time series,
+# and the time axis shared by all rows. Rows are filled in place, no appends:
+class modelTable(object):
+	def __init__(self,fields,nrows,times,timeField):
+		self.fields = list(fields)
+		self.nrows = nrows
+		self.shared = {timeField:times}
+		self.rows = {}
+
+	def setRows(self,field,values):
+		# values: array with nrows as first dimension:
+		values = np.asarray(values)
+		if values.shape[0]!=self.nrows:
+			raise ValueError('modelTable: '+field+' has '+str(values.shape[0])+' rows, expected '+str(self.nrows))
+		self.rows[field] = values
+
+	def matrix(self,field,rows=None):
+		# all rows (or the given rows) of field in one array (e.g. (nstations,ntimes)):
+		if rows is None:
+			return self.rows[field]
+		return self.rows[field][rows]
+
+	def get(self,row,field):
+		# zero-copy view of field at row (row None: station outside the model domain):
+		if field in self.shared:
+			return self.shared[field]
+		if row is not None and field in self.rows:
+			return self.rows[field][row]
+		if field in self.fields or field in self.rows:
+			return np.array([])
+		raise AttributeError(field)
+
+# a modelAtSensorLocation is a view of one row of a modelTable; fields are read as
+# attributes (Times, pointMSLP, ocean_time, pointSSH, ...):
 class modelAtSensorLocation(object):
-	def __init__(self,fields):
-		# initialize each field (attribute) to []:
-		for field in fields:
-			setattr(self,field,np.array([]))
+	__slots__ = ('table','row','location')
+	def __init__(self,table,row,location):
+		self.table = table
+		self.row = row
+		self.location = location
+
+	def __getattr__(self,field):
+		if field.startswith('__') or field in modelAtSensorLocation.__slots__:
+			raise AttributeError(field)
+		return self.table.get(self.row,field)
+
+	def __getstate__(self):
+		return (self.table,self.row,self.location)
+
+	def __setstate__(self,state):
+		self.table,self.row,self.location = state
 
 def findStationIndexInGrid(stationLon,stationLat,longrid2d,latgrid2d):
 	a = abs(longrid2d-stationLon)+abs(latgrid2d-stationLat)
@@ -54,21 +127,14 @@ def getROMSfilenames(self,startdatenum,operMode):
 		elif os.path.isfile(romsfileop):
 			self.roms_parent_file = romsfileop
 		else:
-			print "******modelData: getROMSfilenames ERROR: NEITHER FILE EXISTS:"
-			print romsfile
-			print romsfileop
-			print "1. CHECK FILENAME \nOR \n2. MODIFY self.roms_parent_file VARIABLE IN modelData.py!"
-			q()
+			raise IOError("modelData: getROMSfilenames: NEITHER FILE EXISTS: "+romsfile+" "+romsfileop)
 
 	else:
 		romsfile = self.romsdir+'roms_BRIFS_parent_'+self.romsdatestring+'_hind_his.nc'
 		if os.path.isfile(romsfile):
 			self.roms_parent_file = romsfile
 		else:
-			print "******modelData: getROMSfilenames ERROR: THE FILE DOES NOT EXIST:"
-			print romsfile
-			print "1. CHECK FILENAME \nOR \n2. MODIFY self.roms_parent_file VARIABLE IN modelData.py!"
-			q()
+			raise IOError("modelData: getROMSfilenames: THE FILE DOES NOT EXIST: "+romsfile)
 
 	self.roms_child_file = self.roms_parent_file.replace('parent','child')
 
@@ -76,173 +142,215 @@ def getROMSfilenames(self,startdatenum,operMode):
 
 # define class which contains fields (attributes) from fields array:
 class modelData(object):
-	def __init__(self,stations,startdatenum,wrfFields,romsFields,wrfdir,romsdir, operMode):
+	def __init__(self,stations,startdatenum,wrfFields,romsFields,wrfdir,romsdir, operMode, cachedir=None):
 		self.stations = stations
 		self.startdatenum = startdatenum
 		self.wrfFields = wrfFields
 		self.romsFields = romsFields
 		self.wrfdir = wrfdir
 		self.romsdir =  romsdir
-		self.WRFatSensorLocation = modelAtSensorLocation(self.wrfFields)
-		self.WRFall = np.array([])
+		self.cachedir = cachedir
 		self.ROMSatSensorLocation = np.array([])
 
-		self.wrfdatestring = datetime.strftime(self.startdatenum,'%Y-%m-%d_12:00:00')
-		self.romsdatestring = datetime.strftime(self.startdatenum,'%Y%m%d')
+		# (startdatenum may be None when only given wrfout files are read, see readWRFfiles):
+		if self.startdatenum is not None:
+			self.wrfdatestring = datetime.strftime(self.startdatenum,'%Y-%m-%d_12:00:00')
+			self.romsdatestring = datetime.strftime(self.startdatenum,'%Y%m%d')
 
-		self.wrf_file = self.wrfdir+'wrfout_d02_'+self.wrfdatestring
+			self.wrf_file = self.wrfdir+'wrfout_d02_'+self.wrfdatestring
 
 	def readWRF(self):
-		# WRF reader
-		# loop over three days of netCDF results:
-		locations=np.array([])
-		f = Dataset(self.wrf_file)
-
-		print "\nReading WRF for date: ",self.wrfdatestring," ..."
-
-		# read WRF file:
-		wrflon3d = f.variables['XLONG'][:]
-		wrflat3d = f.variables['XLAT'][:]
-		HGT = f.variables['HGT'][:]
-		T2 = f.variables['T2'][:]
-		Q2 = f.variables['Q2'][:]
-		PSFC = f.variables['PSFC'][:]
-
-		# find grid indices of station locations in WRF grid:
-		for station in self.stations:
-			# print "Reading WRF file: "+self.wrf_file
-			print "Extracting WRF at location: ",station.location
-			currentWRF = modelAtSensorLocation(self.wrfFields)
-
-			# loop over the fields that are supposed to be read:
-			for field in self.wrfFields:
-
-				# some fields are not in the netCDF but we need them for the verification,
-				# so we try to read the netCDF and pass if it doesn't work out. If the field
-				# can be read from netCDF, we append it to the currentWRF:
-				try:
-					if 'Times' in field:
-						t = ["".join(f.variables[field][k]) for k in range(len(f.variables[field][:]))]
-						setattr(currentWRF,field,np.append(getattr(currentWRF, field),t))
-					elif 'XLONG' in field or 'XLAT' in field:
-						setattr(currentWRF,field,np.array(f.variables[field][0,:,:]))
-					else:
-						setattr(currentWRF,field,np.append(getattr(currentWRF, field),np.array(f.variables[field][:])))
-				except:
-					pass
-
-			# append station location to currentWRF:
-			currentWRF.location = np.append(currentWRF.location,station.location)
-			# find indices of station location in WRF grid:
-			i_station,j_station = findStationIndexInGrid(station.LON,station.LAT,wrflon3d[0,:,:],wrflat3d[0,:,:])
-			# write station's lat,lon position to currentWRF
-			currentWRF.pointLon  = np.append(currentWRF.pointLon,i_station)
-			currentWRF.pointLat = np.append(currentWRF.pointLat,j_station)
-
-			# compute mean sea level pressure at this point
-			currentWRF.pointMSLP=np.append(currentWRF.pointMSLP,\
-			np.array(1.e-2 * PSFC[:,i_station,j_station]*np.exp(9.81*HGT[:,i_station,j_station]/(287*T2[:,i_station,j_station]*(1+0.61*Q2[:,i_station,j_station])))))
-
-			# compute mean sea level pressure at this point
-			currentWRF.pointPSFC=np.append(currentWRF.pointPSFC,np.array(1.e-2 * PSFC[:,i_station,j_station]))
-
-			# append current station to all stations:
-			self.WRFall = np.append(self.WRFall,currentWRF)
-
-		return self.WRFall
+		# WRF reader for a single date (self.startdatenum):
+		return self.readWRFdays([self.startdatenum])[0]
+
+	def readWRFdays(self,dates):
+		# point-sliced WRF reader for several forecast days in one call. Station grid
+		# indices are resolved once and only the [:,i,j] columns of the needed fields
+		# are read from each wrfout file. Returns a list (one element per date) of
+		# stations-long arrays of modelAtSensorLocation objects, as readWRF does.
+		return self.readWRFfiles(self.wrfFilenames(dates))
+
+	def wrfFilenames(self,dates):
+		# wrfout files of the given days in wrfdir:
+		return [self.wrfdir+'wrfout_d02_'+datetime.strftime(date,'%Y-%m-%d_12:00:00') for date in dates]
+
+	def readWRFfiles(self,wrfFiles):
+		# point-sliced WRF reader for a list of wrfout files (see readWRFdays). The series
+		# of files extracted before at the same stations are loaded from the series cache:
+		cache = self.seriesCache()
+		grid = None
+		allDays = []
+		for wrf_file in wrfFiles:
+			series = cache.load(wrf_file,self.stations,'wrf',self.wrfFields,interpolationMethod) if cache else None
+			if series is None:
+				# grid indices and interpolation weights, once for all files of the call:
+				if grid is None:
+					grid = self.wrfGrid(wrf_file)
+				series = self.extractWRF(wrf_file,grid)
+				if cache:
+					series = cache.save(wrf_file,self.stations,'wrf',self.wrfFields,series,interpolationMethod)
+			else:
+				print "\nWRF file: ",wrf_file," (cached series)"
+
+			# one table per day, row k is station k:
+			currentWRF = modelTable(self.wrfFields,len(self.stations),series['Times'],'Times')
+			for field in ['XLONG','XLAT','pointLon','pointLat']+diagnosticFields(self.wrfFields):
+				currentWRF.setRows(field,series[field])
+
+			WRFall = np.empty(len(self.stations),dtype=object)
+			for k,station in enumerate(self.stations):
+				print "Extracting WRF at location: ",station.location
+				WRFall[k] = modelAtSensorLocation(currentWRF,k,station.location)
+
+			allDays.append(WRFall)
+
+		return allDays
+
+	def seriesCache(self):
+		# cache of the extracted series (None without cachedir):
+		if not self.cachedir:
+			return None
+		return seriesCache(os.path.join(self.cachedir,'series'))
+
+	def wrfGrid(self,wrf_file):
+		# grid indices of station locations in WRF grid (grid is the same for all days)
+		# and the interpolation operator of the stations inside the domain. The
+		# station-to-grid index is built once per grid and persisted in cachedir:
+		f = registry.open(wrf_file)
+		index = gridIndexFromFile(f,'XLONG','XLAT',self.cachedir)
+		points = [index.find(station.LON,station.LAT) for station in self.stations]
+		for k,station in enumerate(self.stations):
+			if not points[k][2]:
+				print "Station ",station.location," is outside the WRF domain (",index.distance(station.LON,station.LAT)," km from nearest cell)."
+		grid = {'points':points,'inside':np.array([p[2] for p in points],dtype=bool)}
+		# lon/lat of the station grid cells:
+		grid['XLONG'] = np.array([f.variables['XLONG'][0,i,j] for i,j,inside in points])
+		grid['XLAT'] = np.array([f.variables['XLAT'][0,i,j] for i,j,inside in points])
+		# interpolation operator (built once per grid):
+		if np.any(grid['inside']):
+			grid['interp'] = gridInterpolatorFromIndex(index,[station.LON for station,ok in zip(self.stations,grid['inside']) if ok],\
+			[station.LAT for station,ok in zip(self.stations,grid['inside']) if ok],interpolationMethod)
+			grid['W'] = grid['interp'].operator()
+		return grid
+
+	def extractWRF(self,wrf_file,grid):
+		# series of one wrfout file at the stations (dict of arrays, see readWRFfiles):
+		print "\nReading WRF file: ",wrf_file," ..."
+		# (the first file is already open from the grid index lookup):
+		f = registry.open(wrf_file)
+
+		# decode times once per file:
+		t = decodeWRFTimes(f)
+		report.read(wrf_file,'Times',t)
+
+		series = {'Times':t,'XLONG':grid['XLONG'],'XLAT':grid['XLAT'],\
+		'pointLon':np.array([p[0] for p in grid['points']]),'pointLat':np.array([p[1] for p in grid['points']])}
+
+		# read the cells around the stations of only the raw variables the requested
+		# diagnostics (e.g. mean sea level pressure) depend on, evaluate them on the cells
+		# and interpolate each to the stations in one product (stations outside the domain
+		# get NaNs):
+		inside = grid['inside']
+		outputs = diagnosticFields(self.wrfFields)
+		for name in outputs:
+			series[name] = np.full((len(self.stations),len(t)),np.nan)
+		if np.any(inside) and outputs:
+			W = grid['W']
+			values = evaluate(outputs,grid['interp'].read(f,rawInputs(outputs)))
+			for name in outputs:
+				series[name][inside] = W.dot(values[name])
+		registry.close(wrf_file)
+
+		return series
 
 	def readROMS(self,startdatenum,operMode):
-
-		# read grid:
-		print ""
-		print "Reading ROMS parent..."
+		# ROMS reader: every station is read from the finest nest containing it (see
+		# romsNests.py), and a nest file is opened only if a station is assigned to it.
+		# Grid and time axes are read once per file and only the station columns
+		# zeta[:,i,j] are read. Returns a stations-long array of modelAtSensorLocation objects.
 
 		# get ROMS filenames and check if they exist:
 		self.roms_parent_file,self.roms_child_file = getROMSfilenames(self,startdatenum,operMode)
 
-		# open netCDF:
-		f_parent = Dataset(self.roms_parent_file)
-		f_child = Dataset(self.roms_child_file)
-
-
-
-		roms_parent_lon = f_parent.variables['lon_rho'][:]
-		roms_parent_lat = f_parent.variables['lat_rho'][:]
-		roms_parent_mask = f_parent.variables['mask_rho'][:]
-		roms_parent_zeta = f_parent.variables['zeta'][:]
-
-		# set boundaries:
-		roms_parent_lonmin = np.amin(np.amin(roms_parent_lon))
-		roms_parent_lonmax = np.amax(np.amax(roms_parent_lon))
-		roms_parent_latmin = np.amin(np.amin(roms_parent_lat))
-		roms_parent_latmax = np.amax(np.amax(roms_parent_lat))
-
-		# determine if child ROMS needs to be read:
-		ciutadellaDataExists=False
-
-		for station in self.stations:
-			if 'ciutadella' in station.location:
-				ciutadellaDataExists=True
-
-		# if yes, read it:
-		if ciutadellaDataExists:
-			print "Reading ROMS child..."
-			roms_child_lon = f_child.variables['lon_rho'][:]
-			roms_child_lat = f_child.variables['lat_rho'][:]
-			roms_child_mask = f_child.variables['mask_rho'][:]
-			roms_child_zeta = f_child.variables['zeta'][:]
-
-		# loop over all stations:
-		for k in range(self.stations.size):
-			# initialize object that contains ROMS values at sensor locations:
-			currentROMS = modelAtSensorLocation(self.romsFields)
-			currentROMS.location = np.append(currentROMS.location,self.stations[k].location)
-			print "Extracting ROMS at location: ",currentROMS.location[0]
-
-			# if we read ciutadella data, we read ROMS_child, else we read ROMS_parent:
-			if 'ciutadella' not in currentROMS.location:
-				# we loop over fields to be filled:
-				for field in self.romsFields:
-					# if they are contained in the netCDF, fill them:
-					try:
-						if 'ocean_time' in field:
-							t = [datetime.strptime("1968-05-23","%Y-%m-%d") + timedelta(seconds = f_parent.variables[field][x]) for x in range(len(f_parent.variables[field][:]))]
-							t = [datetime.strftime(tt,"%Y%m%d%H%M") for tt in t]
-							setattr(currentROMS,field,t)
-						else:
-							setattr(currentROMS,field,np.array(f_parent.variables[field][:]))
-					# if they are not contained in the netCDF, they will be filled manually, so just pass.
-					except:
-						pass
-			else: # we read ROMS_child:
-				for field in self.romsFields:
-					try:
-						if 'ocean_time' in field:
-							t = [datetime.strptime("1968-05-23","%Y-%m-%d") + timedelta(seconds = f_child.variables[field][x]) for x in range(len(f_child.variables[field][:]))]
-							t = [datetime.strftime(tt,"%Y%m%d%H%M") for tt in t]
-							setattr(currentROMS,field,t)
-						else:
-							setattr(currentROMS,field,np.array(f_child.variables[field][:]))
-					except:
-						pass
-			#
-			# if not ciutadella, work with ROMS_parent
-			if 'ciutadella' not in currentROMS.location:
-				# we find station's location in ROMS grid:
-				i_station,j_station = findStationIndexInGrid(self.stations[k].LON,self.stations[k].LAT,roms_parent_lon,roms_parent_lat)
-				# if it is inside the ROMS domain, append its lons/lats to the currentROMS, otherwise ignore.
-				if i_station > 0 and i_station < len(roms_parent_lon[1,:]) and\
-				j_station > 0 and j_station < len(roms_parent_lat[:,1]):
-					currentROMS.pointLon  = np.append(currentROMS.pointLon,i_station)
-					currentROMS.pointLat = np.append(currentROMS.pointLat,j_station)
-					currentROMS.pointSSH = np.append(currentROMS.pointSSH, np.array(roms_parent_zeta[:,i_station,j_station]))
-			else: # if ciutadella, work with ROMS_child:
-				i_station,j_station = findStationIndexInGrid(self.stations[k].LON,self.stations[k].LAT,roms_child_lon,roms_child_lat)
-				currentROMS.pointLon  = np.append(currentROMS.pointLon,i_station)
-				currentROMS.pointLat = np.append(currentROMS.pointLat,j_station)
-				currentROMS.pointSSH = np.append(currentROMS.pointSSH, np.array(roms_child_zeta[:,i_station,j_station]))
-
-			# append currentROMS and return:
-			self.ROMSatSensorLocation = np.append(self.ROMSatSensorLocation,currentROMS)
+		# nests containing each station, finest grid first:
+		files = nestFiles(self.roms_parent_file)
+		order,candidates = assignStations(files,self.stations,self.cachedir)
+		# current candidate of each station (a station outside the grid of its nest is
+		# passed on to the next coarser nest containing it):
+		current = [0]*len(self.stations)
+		cache = self.seriesCache()
+
+		self.ROMSatSensorLocation = np.empty(len(self.stations),dtype=object)
+
+		for n_file in order:
+			nest,romsfile = files[n_file]
+			stationIndices = [k for k in range(len(self.stations)) if candidates[k][current[k]]==n_file]
+			# skip the file if no station needs it:
+			if not stationIndices:
+				continue
+
+			nestStations = [self.stations[k] for k in stationIndices]
+			series = cache.load(romsfile,nestStations,'roms',self.romsFields,interpolationMethod) if cache else None
+			if series is None:
+				series = self.extractROMS(nest,romsfile,nestStations)
+				if cache:
+					series = cache.save(romsfile,nestStations,'roms',self.romsFields,series,interpolationMethod)
+			else:
+				print ""
+				print "ROMS file: ",romsfile," (cached series)"
+
+			# one table per file, rows are the stations inside its domain:
+			insides = series['inside']
+			currentROMS = modelTable(self.romsFields,int(np.sum(insides)),series['ocean_time'],'ocean_time')
+			if np.any(insides):
+				for field in ['pointLon','pointLat','pointSSH','lon_rho','lat_rho','h']:
+					if field in series:
+						currentROMS.setRows(field,series[field])
+
+			n = 0
+			for k,inside in zip(stationIndices,insides):
+				print "Extracting ROMS at location: ",self.stations[k].location
+				# if it is inside the ROMS domain, view its row, otherwise try the next
+				# coarser nest, or ignore:
+				if inside:
+					self.ROMSatSensorLocation[k] = modelAtSensorLocation(currentROMS,n,self.stations[k].location)
+					n+=1
+				elif current[k]+1<len(candidates[k]):
+					current[k] += 1
+				else:
+					print "Station ",self.stations[k].location," is outside the ROMS domain ",romsfile
+					self.ROMSatSensorLocation[k] = modelAtSensorLocation(currentROMS,None,self.stations[k].location)
 
 		return self.ROMSatSensorLocation
+
+	def extractROMS(self,nest,romsfile,stations):
+		# series of one ROMS nest file at stations (dict of arrays: ocean_time, inside flags
+		# and the fields of the stations inside its grid, see readROMS):
+		print ""
+		print "Reading ROMS file: ",romsfile," ..."
+		f = Dataset(romsfile)
+
+		# decode times once per file:
+		t = decodeTime(f.variables['ocean_time'],'seconds since 1968-05-23 00:00:00')
+		report.read(romsfile,'ocean_time',t)
+
+		# station-to-grid indices (built once per grid, persisted in cachedir):
+		index = gridIndexFromFile(f,'lon_rho','lat_rho',self.cachedir)
+		refreshFootprint(nest,f,index.key,self.cachedir)
+		points = [index.find(station.LON,station.LAT) for station in stations]
+		insidePoints = [(i_station,j_station) for i_station,j_station,inside in points if inside]
+		series = {'ocean_time':t,'inside':np.array([p[2] for p in points],dtype=bool)}
+
+		# read the cells of zeta around the stations and interpolate them (wet cells only)
+		# to all stations in one product; point values of grid fields at the nearest cells:
+		if insidePoints:
+			interp = gridInterpolatorFromIndex(index,[station.LON for station,p in zip(stations,points) if p[2]],\
+			[station.LAT for station,p in zip(stations,points) if p[2]],interpolationMethod)
+			series['pointSSH'] = interp.operator(interp.readWet(f)).dot(interp.read(f,['zeta'])['zeta'])
+			series['pointLon'] = np.array([i for i,j in insidePoints])
+			series['pointLat'] = np.array([j for i,j in insidePoints])
+			for field in ['lon_rho','lat_rho','h']:
+				if field in self.romsFields:
+					series[field] = np.array([f.variables[field][i,j] for i,j in insidePoints])
+		f.close()
+		return series
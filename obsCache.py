@@ -0,0 +1,151 @@
+#!/usr/bin/python
+"""
+Local on-disk cache of SOCIB observation series, keyed by OpenDAP URL and time range.
+
+The calls
+
+cache = obsCache(cachedir,maxSizeMB)
+raw,timeFields = cache.read(fname,fields,t0,t1,fetch)
+
+return the raw observation fields of fname in the time window [t0,t1]
+(numpy.datetime64) and the list of its time-dependent fields. Only the part of the window not yet held locally is
+requested from the server with
+
+raw,timeFields,lastTime = fetch(fname,fields,t0,t1,newerThan)
+
+and appended to the local copy, so consecutive dates of a backfill touch the
+network once per station, and the next day only fetches the newer samples.
+Entries are stored as uncompressed .npz files; when the cache grows beyond
+maxSizeMB the least recently used entries are removed.
+
+INPUT:
+--cachedir: directory for the cached series
+--maxSizeMB: size cap of the cache directory in MB
+
+OUTPUT:
+--raw: dict of numpy arrays, one per field found in the file (time as datetime64)
+--timeFields: list of fields in raw that have the time dimension
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import os,json,hashlib
+import numpy as np
+from runReport import report
+
+# version of the cache entry layout; entries of other versions are fetched again:
+cacheVersion = 2
+
+class obsCache(object):
+	def __init__(self,cachedir,maxSizeMB=2000):
+		self.cachedir = cachedir
+		self.maxSize = maxSizeMB*1024*1024
+		self.hits = 0
+		self.misses = 0
+		if not os.path.isdir(self.cachedir):
+			try:
+				os.makedirs(self.cachedir)
+			except OSError:
+				# created concurrently by another process:
+				if not os.path.isdir(self.cachedir):
+					raise
+
+	def entryName(self,fname):
+		return os.path.join(self.cachedir,'obs_'+hashlib.sha1(fname).hexdigest()+'.npz')
+
+	def load(self,fname):
+		# load cached entry of fname, or None if there is none:
+		npzname = self.entryName(fname)
+		if not os.path.isfile(npzname):
+			return None
+		try:
+			with np.load(npzname) as npz:
+				meta = json.loads(str(npz['_meta']))
+				raw = dict([(field,npz[field]) for field in npz.files if field!='_meta'])
+			if meta.get('version')!=cacheVersion:
+				return None
+			meta['start'] = np.datetime64(meta['start'])
+			meta['end'] = np.datetime64(meta['end'])
+		except:
+			# unreadable (e.g. truncated) entry, fetch again:
+			return None
+		# mark as recently used:
+		os.utime(npzname,None)
+		return meta,raw
+
+	def save(self,fname,meta,raw):
+		npzname = self.entryName(fname)
+		arrays = dict(raw)
+		meta = dict(meta,version=cacheVersion,start=str(meta['start']),end=str(meta['end']))
+		arrays['_meta'] = np.array(json.dumps(meta))
+		# (one temporary file per process, several configurations may save the same file):
+		tmp = npzname+'.tmp%d' % os.getpid()
+		with open(tmp,'wb') as fp:
+			np.savez(fp,**arrays)
+		os.rename(tmp,npzname)
+		self.evict(keep=npzname)
+
+	def evict(self,keep=None):
+		# remove least recently used entries until the cache fits into maxSize:
+		entries = []
+		for name in os.listdir(self.cachedir):
+			path = os.path.join(self.cachedir,name)
+			if name.endswith('.npz') and path!=keep:
+				entries.append((os.path.getmtime(path),os.path.getsize(path),path))
+		total = sum([size for mtime,size,path in entries])
+		if keep and os.path.isfile(keep):
+			total += os.path.getsize(keep)
+		for mtime,size,path in sorted(entries):
+			if total<=self.maxSize:
+				break
+			try:
+				os.remove(path)
+				total -= size
+			except OSError:
+				pass
+
+	def read(self,fname,fields,t0,t1,fetch):
+		entry = self.load(fname)
+		timeField = [field for field in fields if 'time' in field][0]
+
+		# an entry is usable only if it was fetched for (at least) the same fields:
+		if entry is not None and not set(fields)<=set(entry[0]['fields']):
+			entry = None
+
+		if entry is not None and entry[0]['start']<=t0 and t1<=entry[0]['end']:
+			# whole window is held locally:
+			self.hits += 1
+			report.count('obsCache','hit')
+			meta,raw = entry
+		elif entry is not None and entry[0]['start']<=t0<=entry[0]['end']:
+			# fetch only the samples newer than the local copy and append them:
+			self.misses += 1
+			report.count('obsCache','partial')
+			meta,raw = entry
+			new,timeFields,lastTime = fetch(fname,fields,None,t1,meta['end'])
+			for field in new:
+				if field in meta['timeFields'] and field in raw:
+					raw[field] = np.concatenate((raw[field],new[field]))
+				else:
+					raw[field] = new[field]
+			meta['end'] = coveredEnd(t1,lastTime,meta['end'])
+			self.save(fname,meta,raw)
+		else:
+			# nothing usable held locally, fetch the window:
+			self.misses += 1
+			report.count('obsCache','miss')
+			raw,timeFields,lastTime = fetch(fname,fields,t0,t1,None)
+			meta = {'url':fname,'fields':list(fields),'timeFields':list(timeFields),\
+			'start':t0,'end':coveredEnd(t1,lastTime,t0)}
+			self.save(fname,meta,raw)
+
+		# return the [t0,t1] slice of the time-dependent fields:
+		window = slice(np.searchsorted(raw[timeField],t0,side='left'),np.searchsorted(raw[timeField],t1,side='right'))
+		return dict([(field,raw[field][window] if field in meta['timeFields'] else raw[field]) for field in raw]),meta['timeFields']
+
+def coveredEnd(t1,lastTime,previousEnd):
+	# the window is covered up to t1, or only up to the last sample the server had
+	# if t1 lies beyond it (newer samples may still arrive):
+	if lastTime is None:
+		return previousEnd
+	return max(previousEnd,min(t1,lastTime))
@@ -2,19 +2,29 @@
 """
 The call
 
-stations,sensorType = obsData(fileList,sensorType,observationFields).read()
+stations,sensorType = obsData(fileList,sensorType,observationFields,startdatenum,enddatenum,cache).read()
 
 reads available data from the list provided by getAllObservations.py, and merges
-the data in time, if neccessary.
+the data in time, if neccessary. If startdatenum and enddatenum are given, the
+time coordinate is read first and only the slice of each variable covering
+[startdatenum,enddatenum] is requested from the (OpenDAP) server. If an obsCache
+object is given as cache, the window is taken from the local cache and only
+samples not held locally yet are requested. With nworkers>1, files are read in
+parallel by a pool of nworkers processes.
 
 INPUT:
 --fileList: a list of netCDF files provided by getAllObservations.py
 --sensorType: a list of sensor types from SOCIB network, provided by getAllObservations.py
 --observationFields: a list of observation fields to read from netCDFs in fileList
+--startdatenum,enddatenum: (optional) datetimes limiting the time window to read
+--cache: (optional) obsCache object, see obsCache.py
+--nworkers: (optional) number of files read in parallel
 
 OUTPUT:
---stations: a list of station objects, containing data about the fields in the
-	observationFields list. Merged in time if neccessary.
+--stations: an array of station objects, containing data about the fields in the
+	observationFields list. Merged in time if neccessary. The data of all stations
+	are held column-wise in one stationTable (obsData.table, station.table), and each
+	station object is a zero-copy view of its part of the table.
 --sensorType: a merged list of sensorType-s for every station in the stations list
 
 Author: Matjaz Licer, NIB MBS @socib
@@ -25,22 +35,101 @@ from datetime import datetime,timedelta
 from netCDF4 import Dataset
 import numpy as np
 from sys import exit as q
-
-# define class which contains fields (attributes) from fields array:
+from concurrentFetch import processMap
+from datasetRegistry import registry
+from timeAxis import *
+from runReport import report
+
+# station data are held column-wise in a stationTable: each time-dependent field
+# of all stations is stored in one flat array, and offsets[field][k]:offsets[field][k+1]
+# is the slice of station k. Static fields (LON, LAT, ...) are held per station.
+class stationTable(object):
+	def __init__(self,fields,raws,timeFieldLists,locations):
+		# raws: list of dicts of arrays (one per station), timeFieldLists: list of
+		# the time-dependent fields of each raw dict, locations: list of station names:
+		nstations = len(raws)
+		self.fields = list(fields)
+		self.location = np.array(locations,dtype=object)
+		self.values = {}
+		self.offsets = {}
+		self.static = {}
+		for field in self.fields:
+			series = [raw[field] if field in raw and field in timeFields else None \
+			for raw,timeFields in zip(raws,timeFieldLists)]
+			if any([x is not None for x in series]):
+				# preallocate the flat array and copy each station into its slice:
+				counts = np.array([0 if x is None else len(x) for x in series],dtype=int)
+				self.offsets[field] = np.concatenate(([0],np.cumsum(counts)))
+				dtype = np.result_type(*[x for x in series if x is not None])
+				self.values[field] = np.empty(self.offsets[field][-1],dtype=dtype)
+				for k,x in enumerate(series):
+					if x is not None:
+						self.values[field][self.offsets[field][k]:self.offsets[field][k+1]] = x
+			else:
+				self.static[field] = np.empty(nstations,dtype=object)
+				for k,raw in enumerate(raws):
+					self.static[field][k] = raw.get(field,np.array([]))
+
+	def __len__(self):
+		return len(self.location)
+
+	def get(self,k,field):
+		# zero-copy view of field at station k:
+		if field in self.values:
+			return self.values[field][self.offsets[field][k]:self.offsets[field][k+1]]
+		if field in self.static:
+			return self.static[field][k]
+		if field in self.fields:
+			return np.array([])
+		raise AttributeError(field)
+
+	def stations(self):
+		# object array of station views, one per station:
+		stations = np.empty(len(self),dtype=object)
+		for k in range(len(self)):
+			stations[k] = station(self,k)
+		return stations
+
+# a station is a view of station k in a stationTable; fields are read as attributes
+# (station.time, station.SLEV, ...) and missing fields are empty arrays:
 class station(object):
-	def __init__(self,fields):
-		# initialize each field (attribute) to []:
-		for field in fields:
-			setattr(self,field,np.array([]))
-
-def mergeStationObjectProperties(objectToMergeFrom, objectToMergeTo):
-	# loop over contents of objectToMergeFrom and append its data to objectToMergeTo
-	for property in objectToMergeFrom.__dict__:
-		# only merge station data, not its metadata (location,LAT,LON):
-		if property not in ['location','LAT','LON']:
-			setattr(objectToMergeTo, property, np.append(getattr(objectToMergeTo, property),getattr(objectToMergeFrom, property)))
-
-	return objectToMergeTo
+	__slots__ = ('table','k')
+	def __init__(self,table,k):
+		self.table = table
+		self.k = k
+
+	def __getattr__(self,field):
+		if field.startswith('__') or field in station.__slots__:
+			raise AttributeError(field)
+		return self.table.get(self.k,field)
+
+	@property
+	def location(self):
+		return self.table.location[self.k]
+
+	def __getstate__(self):
+		return (self.table,self.k)
+
+	def __setstate__(self,state):
+		self.table,self.k = state
+
+def mergeRaw(rawFrom,rawTo,timeFields):
+	# append the time-dependent fields of rawFrom to rawTo (static fields, e.g. LAT,LON, are kept):
+	merged = dict(rawTo)
+	for field in timeFields:
+		if field in rawFrom and field in rawTo:
+			merged[field] = np.concatenate((rawTo[field],rawFrom[field]))
+		elif field in rawFrom:
+			merged[field] = rawFrom[field]
+	return merged
+
+def locationFromFilename(fname):
+	# extract location name from the platform directory of filename
+	# (.../<platform>/L1/<year>/<file>.nc, e.g. station_ciutadella-scb_met001):
+	parts = fname.split('/')
+	platform = parts[parts.index('L1')-1] if 'L1' in parts[1:] else parts[7]
+	m = re.findall(r'(\w+)_(\w+)',platform)
+	return m[0][1]
 
 # define object which contains all available observation data:
 class obsData(object):
@@ -48,64 +137,113 @@ class obsData(object):
 	# --list of netCDF files to be read (fileList)
 	# --list of sensorTypes (sensorType)
 	# --list of data fields to be read from these files (fields list):
-	def __init__(self,fileList,sensorType,fields):
+	# --(optional) start and end of the time window to be read (startdatenum,enddatenum):
+	# --(optional) local observation cache (obsCache object):
+	# --(optional) number of files read in parallel (nworkers):
+	def __init__(self,fileList,sensorType,fields,startdatenum=None,enddatenum=None,cache=None,nworkers=1):
 		self.fileList = fileList
 		self.fields = fields
 		self.sensorType = sensorType
+		self.startdatenum = startdatenum
+		self.enddatenum = enddatenum
+		self.cache = cache
+		self.nworkers = nworkers
 		# initialize obsData.sensors attribute:
 		self.sensors = np.array([])
 
 	# function (method) for netCDF reading (uses netCDF4 Dataset):
 	def read(self):
-		# loop over fileList:
-		for ii,fname in enumerate(self.fileList):
-			f = Dataset(fname)
-			# fill values in currentStation object:
-			currentStation = fillVals(fname,f,self.fields)
-			# append currentStation object to sensors:
-			self.sensors = np.append(self.sensors,currentStation)
+		# read all files, at most nworkers in parallel (one process per file):
+		tasks = [(fname,self.fields,self.startdatenum,self.enddatenum,self.cache) for fname in self.fileList]
+		results = processMap(readStation,tasks,self.nworkers)
+		registry.closeAll()
 
 		# if strdate is at the end of the month(year), and model run spans over two separate months (years),
 		# data has to be merged from two netCDF filenames. And we need to take sensorType into account to
 		# only merge data from the same sensorType:
-
-		# initialize merged temporary arrays:
-		merged = np.array([])
-		mergedSensorTypes = np.array([])
+		raws = []
+		timeFieldLists = []
+		locations = []
+		mergedSensorTypes = []
 
 		# loop over fileList:
 		for ii,fname in enumerate(self.fileList):
+			# (a file that could not be read has no data):
+			raw,timeFields = results[ii] if results[ii] is not None else ({},[])
+			location = locationFromFilename(fname)
 			# if two consecutive files are found that match in sensor type and location, this means
 			# they are from the same station but from two consecutive months (years), so we merge their contents:
-			if ii>0 and self.sensorType[ii]==self.sensorType[ii-1] and  \
-			self.sensors[ii].location == self.sensors[ii-1].location:
-				merged = np.append(merged,mergeStationObjectProperties(self.sensors[ii], self.sensors[ii-1]))
-				mergedSensorTypes = np.append(mergedSensorTypes,self.sensorType[ii])
+			if ii>0 and self.sensorType[ii]==self.sensorType[ii-1] and location==locations[-1]:
+				raws[-1] = mergeRaw(raw,raws[-1],timeFields)
+				timeFieldLists[-1] = sorted(set(timeFieldLists[-1])|set(timeFields))
+			else:
+				raws.append(raw)
+				timeFieldLists.append(timeFields)
+				locations.append(location)
+				mergedSensorTypes.append(self.sensorType[ii])
+
+		# drop stations with no data in the time window:
+		timeField = [field for field in self.fields if 'time' in field][0]
+		hasData = [len(raw.get(timeField,[]))>0 for raw in raws]
+		for ii in np.nonzero(np.logical_not(hasData))[0]:
+			print "No data in time window at station: ",locations[ii]
+		keep = np.nonzero(hasData)[0]
+
+		# one table for all stations, viewed per station:
+		self.table = stationTable(self.fields,[raws[ii] for ii in keep],\
+		[timeFieldLists[ii] for ii in keep],[locations[ii] for ii in keep])
+		self.sensors = self.table.stations()
+		return self.sensors,np.array(mergedSensorTypes)[keep]
+
+def readRaw(f,fields,t0=None,t1=None,newerThan=None):
+	# read the raw fields of an open netCDF file. The time coordinate is read first and
+	# decoded to datetime64, and only the slice of time-dependent variables covering
+	# [t0,t1] (or the samples newer than newerThan) is requested. Returns a dict of arrays,
+	# the list of time-dependent fields and the time of the last sample in the file:
+	timeField = [field for field in fields if 'time' in field][0]
+	times = decodeTime(f.variables[timeField],'seconds since 1970-01-01 00:00:00')
+	timeDim = f.variables[timeField].dimensions[0]
+
+	i0 = 0 if t0 is None else np.searchsorted(times,t0,side='left')
+	if newerThan is not None:
+		i0 = np.searchsorted(times,newerThan,side='right')
+	i1 = len(times) if t1 is None else np.searchsorted(times,t1,side='right')
+	window = slice(i0,i1)
+
+	source = f.filepath()
+	report.read(source,timeField,times)
+	raw = {timeField:times[window]}
+	timeFields = [timeField]
+	for field in fields:
+		if field==timeField:
+			continue
+		try:
+			var = f.variables[field]
+			if var.dimensions and var.dimensions[0]==timeDim:
+				raw[field] = np.array(var[window])
+				timeFields.append(field)
 			else:
-				merged = np.append(merged,self.sensors[ii])
-				mergedSensorTypes = np.append(mergedSensorTypes,self.sensorType[ii])
-
-		return merged,mergedSensorTypes
-
-
-def fillVals(fname,f,fields):
-	# initialize an instance of class station, named currentStation:
-	currentStation=station(fields)
-	# extract location name from filename:
-	m = re.findall(r'(\w+)_(\w+)',fname.split('/')[7])
-	currentStation.location=m[0][1]
-
-	# fill currentStation with data fields (if they exist in netCDF):
-	for k,field in enumerate(fields):
-		if 'time' in field:
-			wrftimes = f.variables[field][:]
-			t = [datetime.strptime("1970-01-01","%Y-%m-%d") + timedelta(seconds = wrftimes[x]) for x in range(len(wrftimes))]
-			t = [datetime.strftime(tt,"%Y%m%d%H%M") for tt in t]
-
-			setattr(currentStation,field,np.array(t))
-		else:
-			try:
-				setattr(currentStation,field,np.array(f.variables[field][:]))
-			except:
-				pass
-	return currentStation
+				raw[field] = np.array(var[:])
+			report.read(source,field,raw[field])
+		except:
+			pass
+
+	lastTime = times[-1] if len(times)>0 else None
+	return raw,timeFields,lastTime
+
+def readRawFromFile(fname,fields,t0=None,t1=None,newerThan=None):
+	# read the raw fields (see readRaw) of fname, opened once per run through the dataset registry:
+	f = registry.open(fname)
+	return readRaw(f,fields,t0,t1,newerThan)
+
+def readStation(task):
+	# read the raw fields (see readRaw) of one observation file; task is a tuple of
+	# (fname,fields,startdatenum,enddatenum,cache). Returns raw and its time-dependent fields:
+	fname,fields,startdatenum,enddatenum,cache = task
+	if cache is not None and startdatenum is not None and enddatenum is not None:
+		# take the window from the local cache, fetching only what it does not hold yet:
+		return cache.read(fname,fields,toDatetime64(startdatenum),toDatetime64(enddatenum),readRawFromFile)
+	t0 = None if startdatenum is None else toDatetime64(startdatenum)
+	t1 = None if enddatenum is None else toDatetime64(enddatenum)
+	raw,timeFields,lastTime = readRawFromFile(fname,fields,t0,t1)
+	return raw,timeFields
@@ -11,11 +11,43 @@ INPUT: YYYYMMDD string of the date of verification and oper/hind mode, for examp
 ./performBRIFSverification.py 20160331 oper
 ./performBRIFSverification.py 20160331 hind
 
+or start and end YYYYMMDD strings of a range of dates (backfill) and oper/hind mode:
+
+./performBRIFSverification.py 20160301 20160331 hind
+
+or, for one set of scores of a long range (e.g. a season of hindcasts), streamed in
+chunks of streamChunkHours with bounded memory:
+
+./performBRIFSverification.py 20160101 20160331 hind stream
+
+Several model configurations (oper, hind and the experimental runs registered in
+experiments) are verified in one run by joining their names with commas:
+
+./performBRIFSverification.py 20160331 oper,hind,exp1
+
+Observations are then discovered, read and checked once per date, WRF files of
+all configurations are extracted in one pool and the dates of all configurations
+are verified in parallel against the same observations.
+
+In range mode, every distinct WRF file is extracted once at the union of the
+stations of all dates that need it, and dates are verified by a pool of processes.
+Dates without model output are skipped (and listed), and a date that fails does
+not stop the others.
+
+The timing, I/O and cache records of each verified date are written as a JSON run
+report (runReport_<date>_<mode>.json, see runReport.py) to its plot directory.
+
+Observations, ROMS, statistics and plots are checkpointed under a hash of their
+inputs (files, modification times, fields, code and upstream stages, see
+checkpoints.py), so a re-run of a date (e.g. after a crash, or when the ROMS
+output arrives late) repeats only the stages whose inputs changed. WRF series are
+reused from the series cache (see seriesCache.py).
+
 
 Author: Matjaz Licer, NIB MBS @socib
 matjaz.licer@mbss.org
 """
-import os,sys,re,requests,json
+import os,sys,re,requests,json,hashlib
 from datetime import datetime,timedelta
 from netCDF4 import Dataset
 import pandas
@@ -23,9 +55,16 @@ import numpy as np
 from getAllObservations import *
 from obsData import *
 from modelData import *
+import modelData as modelDataModule
 from plotBRIFS import *
 from mergeWRF import *
 from basicStatistics import *
+from obsCache import *
+from scoreStore import *
+from runReport import report
+from checkpoints import *
+import concurrentFetch
+from concurrentFetch import processMap
 from sys import exit as q
 
 
@@ -41,21 +80,70 @@ def printHelp():
 	print("Example:")
 	print("./performBRIFSverification.py "+datetime.now().strftime("%Y%m%d")+" oper")
 	print("\nor\n./performBRIFSverification.py "+datetime.now().strftime("%Y%m%d")+" hind")
+	print("\nor, for a range of dates:\n./performBRIFSverification.py "+(datetime.now()-timedelta(days=30)).strftime("%Y%m%d")+" "+datetime.now().strftime("%Y%m%d")+" hind")
+	print("\nor, for several model configurations at once:\n./performBRIFSverification.py "+datetime.now().strftime("%Y%m%d")+" oper,hind")
+	print("\nor, for one set of scores of a long range, streamed in chunks:\n./performBRIFSverification.py "+(datetime.now()-timedelta(days=90)).strftime("%Y%m%d")+" "+datetime.now().strftime("%Y%m%d")+" hind stream")
 
 	print("\n")
 	sys.exit()
 
-def main():
+# specify fields for comparisons:
+observationFields=['time','LON','LAT','HEIGHT',\
+'SLEV','QC_SLEV',\
+'WTR_PRE','QC_WTR_PRE',\
+'AIR_PRE','QC_AIR_PRE']
 
-	# check for input date YYYYMMDD from console:
-	try:
-		strdate=sys.argv[1]
-		operMode = sys.argv[2]
-	except:
-		printHelp()
+# (add 'pointPSFC' to verify against the surface pressure instead, see computeStatistics):
+wrfFields=['location','Times','XLONG','XLAT', 'pointLon','pointLat', 'pointMSLP']
+romsFields=['location','ocean_time','lon_rho','lat_rho','h','pointLon','pointLat', 'pointSSH']
 
-	# set OPERATIONAL wrf and roms netCDF output directories:
+# determine timeWindow [hours] for comparisons:
+timeWindow=48
+
+# directory for persistent caches (station-to-grid indices, observations):
+cachedir = '/home/mlicer/BRIFSverif/cache/'
+
+# store of the daily scores of all runs (see scoreStore.py):
+scoreFile = '/home/mlicer/BRIFSverif/scores.sqlite'
+
+# number of dates of a backfill range whose observations are held in memory at once:
+blockDays = 30
 
+# directory of the stage checkpoints of each date (see checkpoints.py):
+checkpointdir = cachedir+'checkpoints/'
+
+# hours during which checkpointed observations are reused (the server may receive
+# newer samples of the window later on):
+observationCheckpointHours = 6
+
+# length [hours] of the chunks of a streamed window (a divisor of 24, so that each chunk
+# is verified against the model runs of one day):
+streamChunkHours = 24
+
+# modules doing the work of each checkpointed stage (their code is part of the key):
+stageModules = {\
+'observations':['getAllObservations','concurrentFetch','obsData','obsCache','timeAxis'],\
+'readWRF':['modelData','gridIndex','gridInterpolation','wrfDiagnostics','timeAxis'],\
+'readROMS':['modelData','romsNests','gridIndex','gridInterpolation','timeAxis'],\
+'statistics':['mergeWRF','basicStatistics','skillAccumulator','spectralScores'],\
+'plots':['plotBRIFS','filters']}
+
+# experimental model configurations, verified like oper and hind under their name:
+# name -> (WRF directory with %s for the date, ROMS directory, ROMS file naming of
+# 'oper' or 'hind' runs), e.g.
+# experiments['exp1'] = ('/home/rissaga/experiments/exp1/WRF/%s/','/home/rissaga/experiments/exp1/ROMS/','hind')
+experiments = {}
+
+def romsMode(operMode):
+	# oper or hind file naming of the ROMS output of configuration operMode:
+	return experiments[operMode][2] if operMode in experiments else operMode
+
+def setDirectories(strdate,operMode):
+	# set the wrf and roms netCDF output directories of an experimental configuration:
+	if operMode in experiments:
+		plotdir = '/home/mlicer/BRIFSverif/pyVerif/'+strdate+'_'+operMode+'/'
+		return experiments[operMode][0] % strdate,experiments[operMode][1],plotdir
+	# set OPERATIONAL wrf and roms netCDF output directories:
 	if operMode=='oper':
 		wrfdir = '/home/rissaga/new_setup/Archive/Outputs/WRF/'+strdate+'_op/'
 	# set HINDCAST wrf and roms netCDF output directories:
@@ -66,79 +154,371 @@ def main():
 	romsdir = '/home/rissaga/new_setup/Archive/Outputs/ROMS/'
 
 	plotdir = '/home/mlicer/BRIFSverif/pyVerif/'+strdate+'_'+operMode+'/'
+	return wrfdir,romsdir,plotdir
 
-	os.system('mkdir -p '+plotdir)
+def wrfDays(startdatenum):
+	# WRF files (days) needed to verify startdatenum: yesterday, today and tomorrow:
+	return [startdatenum-timedelta(days=1),startdatenum,startdatenum+timedelta(days=1)]
 
-	# determine timeWindow [hours] for comparisons:
-	timeWindow=48
+def readObservations(strdate,nworkers):
+	# read the observations of the verification window of strdate, or load them from
+	# a checkpoint of the last observationCheckpointHours. Returns stations,sensorType
+	# or None,None if there are no observations:
+	report.setDate(strdate)
+	key = inputHash(strdate,timeWindow,observationFields,concurrentFetch.dataDiscoveryURL,\
+	concurrentFetch.threddsURL,codeVersion(stageModules['observations']))
+	return checkpointStore(checkpointdir+strdate+'/').run('observations',key,fetchObservations,\
+	strdate,nworkers,maxAgeHours=observationCheckpointHours)
 
-	# parse start date:
+def fetchObservations(strdate,nworkers,window=None):
+	# discover and read the observations of the verification window of strdate (see
+	# readObservations), or of window=(start,end) within the day strdate and after it:
 	startdatenum = datetime.strptime(strdate,'%Y%m%d')
 	enddatenum = startdatenum+timedelta(hours=timeWindow)
-
-	# set WRF files and dates to read:
-	today = startdatenum
-	yesterday = startdatenum-timedelta(days=1)
 	tomorrow = startdatenum+timedelta(days=1)
-	wrfdatestring = datetime.strftime(startdatenum,'%Y-%m-%d_12:00:00')
-	wrfdatestring_yesterday = datetime.strftime(startdatenum-timedelta(days=1),'%Y-%m-%d_12:00:00')
-	wrfdatestring_tomorrow = datetime.strftime(startdatenum+timedelta(days=1),'%Y-%m-%d_12:00:00')
+	hours = timeWindow
+	if window is not None:
+		hours = int(np.ceil((window[1]-startdatenum).total_seconds()/3600.))
 
-	wrf_file = wrfdir+'wrfout_d02_'+wrfdatestring
-	wrf_file_yesterday = wrfdir+'wrfout_d02_'+wrfdatestring_yesterday
-	wrf_file_tomorrow = wrfdir+'wrfout_d02_'+wrfdatestring_tomorrow
+	# get a list of all available observations:
+	with report.stage('getAllObservations'):
+		fileList = getAllObservations(strdate,hours,nworkers)
 
-	# specify fields for comparisons:
-	observationFields=['time','LON','LAT','HEIGHT',\
-	'SLEV','QC_SLEV',\
-	'WTR_PRE','QC_WTR_PRE',\
-	'AIR_PRE','QC_AIR_PRE']
+	# skip date if empty:
+	if not fileList:
+		print('\n No observations found for this date: '+strdate+'!')
+		return None,None
 
-	wrfFields=['location','Times','XLONG','XLAT', 'pointLon','pointLat', 'pointPSFC','pointMSLP']
-	romsFields=['location','ocean_time','lon_rho','lat_rho','h','pointLon','pointLat', 'pointSSH']
+	print "\nReading observation files:"
+	sensorType=[]
+	for k in range(len(fileList)):
+		print fileList[k],"..."
+		# determine the sensorType, if any, from the filename:
+		m = re.findall(r'.*_(\w+-\w+.?)_L1',fileList[k])
+		if m:
+			if 'station' in m[0]:
+				sensorType.append('')
+			else:
+				sensorType.append(m[0])
+	print ""
 
-	# get a list of all available observations:
-	fileList = getAllObservations(strdate,timeWindow)
+	# read the files to 'stations' data object and merge files (sensor types) from different months(years) if neccessary.
+	# Only the slice of each file covering the timeWindow and the span of the three WRF files
+	# (up to 12 UTC on the day after tomorrow) is requested from the server:
+	obsenddatenum = max(enddatenum,tomorrow+timedelta(days=1,hours=12))
+	if window is not None:
+		startdatenum,obsenddatenum = window
+	# Observation series are kept in a local cache (at most 2 GB), so only samples not held yet are fetched:
+	obscache = obsCache(cachedir+'observations/',maxSizeMB=2000)
+	with report.stage('obsData.read'):
+		return obsData(fileList,sensorType,observationFields,startdatenum,obsenddatenum,obscache,nworkers).read()
 
-	# exit if empty:
-	if not fileList:
-		print('\n No observations found for this date: '+strdate+'! \n Exiting.')
-		q()
-	# keep working if not empty:
+def observationHash(stations,sensorType):
+	# content hash of the observations of stations (all views of one stationTable):
+	h = hashlib.sha1()
+	h.update(repr([stationKey(station) for station in stations]))
+	h.update(repr(list(sensorType)))
+	table = stations[0].table if len(stations) else None
+	if table is not None:
+		for field in sorted(table.values):
+			h.update(field)
+			h.update(np.ascontiguousarray(table.values[field]).tostring())
+			h.update(np.ascontiguousarray(table.offsets[field]).tostring())
+	return h.hexdigest()
+
+def stationKey(station):
+	return (station.location,float(station.LON),float(station.LAT))
+
+def extractWRFfile(task):
+	# extract one WRF file at the union of stations of all dates that need it; task is a
+	# tuple (wrf_file,stations,operMode). Returns the modelTable of the file:
+	wrf_file,stations,operMode = task
+	wrf, = modelData(stations,None,wrfFields,romsFields,'','',operMode,cachedir).readWRFfiles([wrf_file])
+	return wrf[0].table
+
+def verifyDate(task):
+	# verify one date, given its stations and the WRF tables of its three days;
+	# task is a tuple (strdate,operMode,stations,sensorType,wrfTables,wrfFiles,nplotworkers),
+	# wrfTables being a list of (modelTable,rows) of the three days, rows mapping stationKey
+	# to table row, and wrfFiles the files they were extracted from. Stages whose inputs
+	# are unchanged since the last run are loaded from their checkpoints:
+	strdate,operMode,stations,sensorType,wrfTables,wrfFiles,nplotworkers = task
+	wrfdir,romsdir,plotdir = setDirectories(strdate,operMode)
+	os.system('mkdir -p '+plotdir)
+	startdatenum = datetime.strptime(strdate,'%Y%m%d')
+	report.setDate(strdate)
+	store = checkpointStore(checkpointdir+strdate+'_'+operMode+'/')
+	obsKey = observationHash(stations,sensorType)
+
+	# WRF at the stations of this date for all three days (views of the shared tables):
+	wrf_yesterday,wrf_today,wrf_tomorrow = [stationViews(table,rows,stations) for table,rows in wrfTables]
+	wrfKey = inputHash(fileState(wrfFiles),wrfFields,modelDataModule.interpolationMethod,codeVersion(stageModules['readWRF']))
+
+	# extract ROMS (from all nest files of the date):
+	romsFiles = romsFilenames(romsdir,strdate,operMode)
+	romsKey = inputHash(obsKey,fileState(romsFiles),romsFields,nestNames,modelDataModule.interpolationMethod,\
+	codeVersion(stageModules['readROMS']))
+	with report.stage('readROMS'):
+		roms = store.run('readROMS',romsKey,modelData(stations,startdatenum,wrfFields,romsFields,wrfdir,romsdir,\
+		operMode,cachedir).readROMS,startdatenum,romsMode(operMode))
+
+	# merge WRF times and air pressures from all three days for all stations and
+	# compute basic statistics (BIAS, RMSE, CORR):
+	statsKey = inputHash(obsKey,wrfKey,romsKey,codeVersion(stageModules['statistics']))
+	with report.stage('basicStatistics'):
+		wrf_t_3days,wrf_p_3days,stats = store.run('statistics',statsKey,computeStatistics,\
+		strdate,sensorType,stations,wrf_yesterday,wrf_today,wrf_tomorrow,roms)
+
+	# keep the scores of this date in the score store:
+	with report.stage('scoreStore'):
+		scoreStore(scoreFile).append(strdate,operMode,stations,sensorType,stats)
+
+	# plot graphs (nplotworkers processes, one figure per task), unless the figures of
+	# the same statistics are there already:
+	plotKey = inputHash(statsKey,plotdir,codeVersion(stageModules['plots']))
+	stored = store.load('plots',plotKey)
+	if stored is not None and all([os.path.isfile(pngname) for pngname in stored['result']]):
+		print "Stage plots is unchanged, figures are in ",plotdir
 	else:
-		print "\nReading observation files:"
-		sensorType=[]
-		for k in range(len(fileList)):
-			print fileList[k],"..."
-			# determine the sensorType, if any, from the filename:
-			m = re.findall(r'.*_(\w+-\w+.?)_L1',fileList[k])
-			if m:
-				if 'station' in m[0]:
-					sensorType.append('')
-				else:
-					sensorType.append(m[0])
-		print ""
-
-	# read the files to 'stations' data object and merge files (sensor types) from different months(years) if neccessary:
-	stations,sensorType = obsData(fileList,sensorType,observationFields).read()
-
-	# extract WRF for available grid points:
-	wrf_yesterday = modelData(stations,yesterday,wrfFields,romsFields,wrfdir,romsdir, operMode).readWRF()
-	wrf_today = modelData(stations,today,wrfFields,romsFields,wrfdir,romsdir, operMode).readWRF()
-	wrf_tomorrow = modelData(stations,tomorrow,wrfFields,romsFields,wrfdir,romsdir, operMode).readWRF()
-
-	# merge WRF times and air pressures from all three days for all stations:
+		with report.stage('plotBRIFS'):
+			plotBRIFS(plotdir,strdate,sensorType,stations,wrf_t_3days,wrf_p_3days,roms,stats,nplotworkers)
+		store.save('plots',plotKey,sorted([plotdir+name for name in os.listdir(plotdir) if name.endswith('.png')]))
+	return strdate
+
+def romsFilenames(romsdir,strdate,operMode):
+	# candidate ROMS output files of all nests of strdate (see getROMSfilenames, romsNests):
+	return [romsdir+'roms_BRIFS_'+nest+'_'+strdate+suffix+'_his.nc' for nest in nestNames \
+	for suffix in (['','_op'] if romsMode(operMode)=='oper' else ['_hind'])]
+
+def missingModelFiles(strdate,operMode):
+	# WRF files of the three days and ROMS parent files of strdate that are missing (an
+	# empty list if the date can be verified in configuration operMode):
+	wrfdir,romsdir,plotdir = setDirectories(strdate,operMode)
+	wrfFiles = modelData([],None,wrfFields,romsFields,wrfdir,romsdir,operMode,cachedir).wrfFilenames(wrfDays(datetime.strptime(strdate,'%Y%m%d')))
+	missing = [filename for filename in wrfFiles if not os.path.isfile(filename)]
+	parentFiles = [filename for filename in romsFilenames(romsdir,strdate,operMode) if '_parent_' in filename]
+	if not any([os.path.isfile(filename) for filename in parentFiles]):
+		missing += parentFiles
+	return missing
+
+def computeStatistics(strdate,sensorType,stations,wrf_yesterday,wrf_today,wrf_tomorrow,roms):
+	# merged WRF times and air pressures of the three days and the basic statistics:
 	wrf_t_3days,wrf_p_3days = mergeWRF(stations,wrf_yesterday,wrf_today,wrf_tomorrow,'pointMSLP')
+	# (surface pressure, needs 'pointPSFC' in wrfFields):
 	# wrf_t_3days,wrf_p_3days = mergeWRF(stations,wrf_yesterday,wrf_today,wrf_tomorrow,'pointPSFC')
+	stats = basicStatistics(strdate,sensorType,stations,wrf_t_3days,wrf_p_3days,roms)
+	return wrf_t_3days,wrf_p_3days,stats
 
-	# extract ROMS
-	roms = modelData(stations,startdatenum,wrfFields,romsFields,wrfdir,romsdir, operMode).readROMS(startdatenum,operMode)
+def stationViews(table,rows,stations):
+	# stations-long array of modelAtSensorLocation views of the table rows of the stations:
+	views = np.empty(len(stations),dtype=object)
+	for k,station in enumerate(stations):
+		views[k] = modelAtSensorLocation(table,rows[stationKey(station)],station.location)
+	return views
 
-	# compute basic statistics (BIAS, RMSE, CORR):
-	stats = basicStatistics(strdate,sensorType,stations,wrf_t_3days,wrf_p_3days,roms)
+def verifyDates(dates,operModes,nworkers,nprocesses):
+	# verify all dates in all configurations operModes (e.g. ['oper','hind']); in blocks of
+	# blockDays, observations of each date are read first (once for all configurations),
+	# then every distinct WRF file is extracted once at the union of stations of the dates
+	# that need it, and finally the dates of all configurations are verified in parallel
+	# by nprocesses processes. Returns, per configuration, the list of (strdate,reason)
+	# of the dates that were not verified (missing or unreadable model output):
+	extracted = {}
+	skipped = dict([(operMode,[]) for operMode in operModes])
+	for b in range(0,len(dates),blockDays):
+		block = []
+		for startdatenum in dates[b:b+blockDays]:
+			strdate = datetime.strftime(startdatenum,'%Y%m%d')
+			stations,sensorType = readObservations(strdate,nworkers)
+			if stations is not None and len(stations)>0:
+				block.append((strdate,stations,sensorType))
+
+		# distinct WRF files of the block (a file linked from several run directories is
+		# the same file) and the stations each of them is needed for; dates without model
+		# output are skipped:
+		fileStations = {}
+		dateFiles = {}
+		for strdate,stations,sensorType in block:
+			for operMode in operModes:
+				missing = missingModelFiles(strdate,operMode)
+				if missing:
+					print "No model output of ",operMode," for ",strdate,", skipped: ",missing
+					skipped[operMode].append((strdate,'missing '+' '.join(missing)))
+					continue
+				wrfdir,romsdir,plotdir = setDirectories(strdate,operMode)
+				wrfFiles = modelData(stations,None,wrfFields,romsFields,wrfdir,romsdir,operMode,cachedir).wrfFilenames(wrfDays(datetime.strptime(strdate,'%Y%m%d')))
+				dateFiles[strdate,operMode] = [os.path.realpath(wrf_file) for wrf_file in wrfFiles]
+				for wrf_file in dateFiles[strdate,operMode]:
+					for station in stations:
+						fileStations.setdefault(wrf_file,{})[stationKey(station)] = station
+
+		# extract the files not extracted yet (or not at all the stations needed):
+		extracted = dict([(wrf_file,extracted[wrf_file]) for wrf_file in fileStations \
+		if wrf_file in extracted and set(fileStations[wrf_file])<=set(extracted[wrf_file][1])])
+		todo = [wrf_file for wrf_file in sorted(fileStations) if wrf_file not in extracted]
+		tasks = []
+		for wrf_file in todo:
+			keys = sorted(fileStations[wrf_file])
+			union = np.empty(len(keys),dtype=object)
+			union[:] = [fileStations[wrf_file][key] for key in keys]
+			tasks.append((wrf_file,union,operModes[0]))
+		# (WRF files are shared by the dates and configurations of the block):
+		report.setDate(None)
+		with report.stage('readWRF'):
+			tables = processMap(extractWRFfile,tasks,nprocesses)
+		for (wrf_file,union,operMode),table in zip(tasks,tables):
+			extracted[wrf_file] = (table,dict([(stationKey(station),row) for row,station in enumerate(union)]))
+
+		# verify the dates of the block in all configurations. Figures are rendered in
+		# parallel when dates are verified one by one (pool workers cannot start pools of
+		# their own):
+		tasks = []
+		for strdate,stations,sensorType in block:
+			for operMode in operModes:
+				if (strdate,operMode) not in dateFiles:
+					continue
+				wrfTables = [extracted[wrf_file] for wrf_file in dateFiles[strdate,operMode]]
+				# (WRF files that could not be extracted have no table):
+				if any([table is None for table,rows in wrfTables]):
+					print "WRF output of ",operMode," for ",strdate," could not be read, skipped."
+					skipped[operMode].append((strdate,'unreadable WRF output'))
+					continue
+				tasks.append((strdate,operMode,stations,sensorType,wrfTables,dateFiles[strdate,operMode]))
+		nplotworkers = nworkers if nprocesses<=1 or len(tasks)<=1 else 1
+		results = processMap(verifyDate,[task+(nplotworkers,) for task in tasks],nprocesses)
+		for task,result in zip(tasks,results):
+			if result is None:
+				skipped[task[1]].append((task[0],'verification failed (see above)'))
+
+		# run report of each verified date of the block, next to its plots:
+		for strdate,operMode,stations,sensorType,wrfTables,wrfFiles in tasks:
+			wrfdir,romsdir,plotdir = setDirectories(strdate,operMode)
+			if os.path.isdir(plotdir):
+				print "Run report: ",report.write(plotdir,strdate,operMode)
+		report.setDate(None)
+	return skipped
+
+def streamVerification(startdatenum,enddatenum,operMode,nworkers,chunkHours=streamChunkHours):
+	# verify the long window [startdatenum,enddatenum) chunk by chunk: observations and
+	# model series of one chunk are read at a time, verified against the model runs of
+	# the day of the chunk, and only the skill accumulators of the pairs are kept, so
+	# memory does not depend on the length of the window. Returns a dict of the skill and
+	# spectral accumulators, keyed by (location,sensorType,accumulator) (see
+	# basicStatistics.accumulators):
+	if 24 % chunkHours:
+		raise ValueError('streamVerification: chunkHours must divide 24, got '+str(chunkHours))
+	totals = {}
+	chunkStart = startdatenum
+	while chunkStart<enddatenum:
+		chunkEnd = min(chunkStart+timedelta(hours=chunkHours),enddatenum)
+		rundate = datetime(chunkStart.year,chunkStart.month,chunkStart.day)
+		strdate = datetime.strftime(rundate,'%Y%m%d')
+		window = (chunkStart,chunkEnd)
+		print "\nStreaming chunk ",chunkStart," - ",chunkEnd
+		report.setDate(strdate)
+		wrfdir,romsdir,plotdir = setDirectories(strdate,operMode)
+
+		# skip chunks without model output (a missing day must not stop a long window):
+		missing = missingModelFiles(strdate,operMode)
+		if missing:
+			print "No model output for chunk ",chunkStart," - ",chunkEnd,", skipped: ",missing
+			chunkStart = chunkEnd
+			continue
+
+		stations,sensorType = fetchObservations(strdate,nworkers,window)
+		if stations is None or len(stations)==0:
+			chunkStart = chunkEnd
+			continue
+
+		model = modelData(stations,rundate,wrfFields,romsFields,wrfdir,romsdir,operMode,cachedir)
+		with report.stage('readWRF'):
+			wrf_yesterday,wrf_today,wrf_tomorrow = model.readWRFdays(wrfDays(rundate))
+		with report.stage('readROMS'):
+			roms = model.readROMS(rundate,romsMode(operMode))
+		with report.stage('basicStatistics'):
+			wrf_t_3days,wrf_p_3days = mergeWRF(stations,wrf_yesterday,wrf_today,wrf_tomorrow,'pointMSLP')
+			stats = basicStatistics(strdate,sensorType,stations,wrf_t_3days,wrf_p_3days,roms,window)
+
+		# add the pairs (and spectra) of the chunk to the accumulators of the window:
+		for k,station in enumerate(stations):
+			for field in accumulators:
+				acc = getattr(stats[k],field)
+				if acc is None:
+					continue
+				key = (station.location,sensorType[k],field)
+				totals[key] = totals[key].merge(acc) if key in totals else acc
+		chunkStart = chunkEnd
+	report.setDate(None)
+	return totals
+
+def writeStreamScores(filename,totals):
+	# BIAS, RMSE, CORR and number of pairs of each station and variable, and the rissaga
+	# band scores and number of spectral segments where computed, as JSON:
+	rows = {}
+	for (location,sensorType,field),acc in sorted(totals.items()):
+		variable,kind = field.rsplit('_',1)
+		row = rows.setdefault((location,sensorType,variable),{'station':location,'sensorType':sensorType,'variable':variable})
+		if kind=='ACC':
+			bias,rmse,corr = [float(value) for value in acc.scores()]
+			row.update({'N':int(acc.n),'BIAS':bias,'RMSE':rmse,'CORR':corr})
+			print "%-20s %-14s %-8s N=%8d BIAS=%10.4f RMSE=%10.4f CORR=%7.4f" % \
+			(location,sensorType,variable,int(acc.n),bias,rmse,corr)
+		else:
+			energyRatio,peakError,coherence = [float(value) for value in acc.scores()]
+			row.update({'SEGMENTS':int(acc.n),'ENERGYRATIO':energyRatio,'PEAKERROR':peakError,'COHERENCE':coherence})
+			print "%-20s %-14s %-8s SEGMENTS=%4d ENERGYRATIO=%8.4f PEAKERROR=%8.2f COHERENCE=%7.4f" % \
+			(location,sensorType,variable,int(acc.n),energyRatio,peakError,coherence)
+	rows = [rows[key] for key in sorted(rows)]
+	with open(filename,'w') as fp:
+		json.dump(rows,fp,indent=1,sort_keys=True)
+	return filename
+
+def main():
+
+	# check for input date YYYYMMDD (or start and end date of a range) and mode(s) from
+	# console, and the optional 'stream' flag of a range:
+	try:
+		stream = len(sys.argv)>4 and sys.argv[4]=='stream'
+		if len(sys.argv)>3:
+			startdatenum = datetime.strptime(sys.argv[1],'%Y%m%d')
+			enddatenum = datetime.strptime(sys.argv[2],'%Y%m%d')
+			operModes = sys.argv[3].split(',')
+		else:
+			startdatenum = enddatenum = datetime.strptime(sys.argv[1],'%Y%m%d')
+			operModes = sys.argv[2].split(',')
+	except:
+		printHelp()
+	for operMode in operModes:
+		if operMode not in ['oper','hind'] and operMode not in experiments:
+			print "Unknown model configuration ",operMode,", not one of oper, hind or ",sorted(experiments)
+			printHelp()
+
+	# maximum number of parallel requests to SOCIB servers:
+	nworkers = 8
+
+	if stream:
+		# one set of scores of the whole range (end date included) per configuration,
+		# streamed in chunks (observations of the later configurations from the obsCache):
+		for operMode in operModes:
+			totals = streamVerification(startdatenum,enddatenum+timedelta(days=1),operMode,nworkers)
+			wrfdir,romsdir,plotdir = setDirectories(sys.argv[1]+'-'+sys.argv[2],operMode)
+			os.system('mkdir -p '+plotdir)
+			print "Scores: ",writeStreamScores(plotdir+'streamScores.json',totals)
+			print "Run report: ",report.write(plotdir,sys.argv[1]+'-'+sys.argv[2],operMode)
+		return
+
+	dates = [startdatenum+timedelta(days=k) for k in range((enddatenum-startdatenum).days+1)]
+
+	# number of processes extracting WRF files and verifying dates (and configurations)
+	# in parallel:
+	nprocesses = min(4,len(dates)*len(operModes))
+
+	skipped = verifyDates(dates,operModes,nworkers,nprocesses)
 
-	# plot graphs:
-	plotBRIFS(plotdir,strdate,sensorType,stations,wrf_t_3days,wrf_p_3days,roms,stats)
+	# dates not verified, per configuration (the other configurations are verified anyway):
+	for operMode in operModes:
+		for strdate,reason in skipped[operMode]:
+			print "Not verified: ",operMode," ",strdate,": ",reason
 
 
 if __name__ == '__main__':
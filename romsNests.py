@@ -0,0 +1,150 @@
+#!/usr/bin/python
+"""
+Registry of the nested ROMS grids: the parent grid and its high-resolution nests.
+
+The calls
+
+files = nestFiles(roms_parent_file)
+order,candidates = assignStations(files,stations,cachedir)
+
+list the output files of all registered nests of a ROMS run (the file of a nest
+is the parent file with 'parent' replaced by the nest name; nests without output
+are skipped) and assign every station to the finest grid whose footprint
+contains it. Footprints (the lon/lat boundary of the rho grid and its mean grid
+spacing) are computed once per nest and grid from the grid perimeter and persisted
+in cachedir, so the files of nests without stations are never opened once their
+grid hash is known (see gridIndex.py). Adding a
+nest, e.g. of another Menorcan harbour, only needs its name in nestNames.
+
+A footprint is keyed by the nest name and the grid hash of gridIndex.py, so
+experiments or ROMS configurations with different grids under the same nest names
+never share footprints; when a nest file is read, refreshFootprint makes sure the
+footprint of its grid is stored.
+
+INPUT:
+--roms_parent_file: ROMS parent output file of the run
+--stations: list of station objects (LON, LAT)
+--cachedir: directory for the persisted footprints; None keeps them in memory only
+
+OUTPUT:
+--files: list of (nest,filename) of the nests with output files
+--order: indices into files from the finest to the coarsest grid
+--candidates: per station, the indices into files of the nests containing it,
+	finest grid first (the coarsest nest if none contains it)
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import os,pickle
+import numpy as np
+from matplotlib.path import Path
+from netCDF4 import Dataset
+from gridIndex import gridHash,knownGridHash
+
+# nests of the BRIFS ROMS configuration, the parent first:
+nestNames = ['parent','child']
+
+# footprints already loaded in this run, keyed by nest name and grid hash:
+loadedFootprints = {}
+
+class footprint(object):
+	def __init__(self,nest,lonPerimeter,latPerimeter,key):
+		self.nest = nest
+		self.key = key
+		self.path = Path(np.column_stack((lonPerimeter,latPerimeter)))
+		# mean grid spacing along the perimeter (scaled to degrees of latitude):
+		coslat = np.cos(np.deg2rad(np.mean(latPerimeter)))
+		self.spacing = np.mean(np.hypot(np.diff(lonPerimeter)*coslat,np.diff(latPerimeter)))
+
+	def contains(self,lons,lats):
+		# bool array, True for the points inside the footprint:
+		return self.path.contains_points(np.column_stack((np.atleast_1d(lons),np.atleast_1d(lats))))
+
+def footprintFromFile(f,nest,cachedir=None):
+	# footprint of the rho grid of the open ROMS file f (only the perimeter is read):
+	lon = f.variables['lon_rho']
+	lat = f.variables['lat_rho']
+	lonPerimeter = np.concatenate((lon[0,:],lon[1:,-1],lon[-1,-2::-1],lon[-2::-1,0]))
+	latPerimeter = np.concatenate((lat[0,:],lat[1:,-1],lat[-1,-2::-1],lat[-2::-1,0]))
+	return footprint(nest,lonPerimeter,latPerimeter,gridHash(f,'lon_rho','lat_rho',cachedir))
+
+def footprintName(nest,key,cachedir):
+	return os.path.join(cachedir,'romsFootprint_'+nest+'_'+key+'.pkl')
+
+def saveFootprint(fp,cachedir):
+	loadedFootprints[(fp.nest,fp.key)] = fp
+	if not cachedir:
+		return
+	if not os.path.isdir(cachedir):
+		try:
+			os.makedirs(cachedir)
+		except OSError:
+			# created concurrently by another process:
+			if not os.path.isdir(cachedir):
+				raise
+	picklename = footprintName(fp.nest,fp.key,cachedir)
+	# (one temporary file per process, several workers may resolve the same nest):
+	tmp = picklename+'.tmp%d' % os.getpid()
+	with open(tmp,'wb') as pf:
+		pickle.dump(fp,pf,pickle.HIGHEST_PROTOCOL)
+	try:
+		os.rename(tmp,picklename)
+	except OSError:
+		# published concurrently by another process:
+		if os.path.isfile(tmp):
+			os.remove(tmp)
+		if not os.path.isfile(picklename):
+			raise
+
+def loadFootprint(nest,key,cachedir=None):
+	# footprint of nest on the grid with hash key, loaded in this run or persisted by an
+	# earlier one; None if there is none:
+	if (nest,key) in loadedFootprints:
+		return loadedFootprints[(nest,key)]
+	if cachedir and os.path.isfile(footprintName(nest,key,cachedir)):
+		with open(footprintName(nest,key,cachedir),'rb') as pf:
+			loadedFootprints[(nest,key)] = pickle.load(pf)
+		return loadedFootprints[(nest,key)]
+	return None
+
+def nestFootprint(nest,romsfile,cachedir=None):
+	# footprint of nest: loaded or persisted for the grid of romsfile, or read from romsfile:
+	key = knownGridHash(romsfile,'lon_rho','lat_rho',cachedir)
+	if key is not None and loadFootprint(nest,key,cachedir) is not None:
+		return loadFootprint(nest,key,cachedir)
+	f = Dataset(romsfile)
+	fp = footprintFromFile(f,nest,cachedir)
+	f.close()
+	saveFootprint(fp,cachedir)
+	return fp
+
+def refreshFootprint(nest,f,key,cachedir=None):
+	# store the footprint of nest for the grid of the open file f (hash key) if it is new:
+	if loadFootprint(nest,key,cachedir) is not None:
+		return
+	print "ROMS nest ",nest," has a new grid, its footprint is updated."
+	saveFootprint(footprintFromFile(f,nest,cachedir),cachedir)
+
+def nestFiles(roms_parent_file):
+	# (nest,filename) of all registered nests with an output file:
+	files = []
+	for nest in nestNames:
+		romsfile = roms_parent_file.replace('parent',nest)
+		if os.path.isfile(romsfile):
+			files.append((nest,romsfile))
+		else:
+			print "ROMS nest ",nest," has no output file ",romsfile
+	return files
+
+def assignStations(files,stations,cachedir=None):
+	# per station, the nests (indices into files) whose footprint contains it, finest first:
+	footprints = [nestFootprint(nest,romsfile,cachedir) for nest,romsfile in files]
+	order = sorted(range(len(files)),key=lambda n: footprints[n].spacing)
+	lons = np.array([float(station.LON) for station in stations])
+	lats = np.array([float(station.LAT) for station in stations])
+	inside = [footprints[n].contains(lons,lats) for n in range(len(files))]
+	candidates = []
+	for k in range(len(stations)):
+		containing = [n for n in order if inside[n][k]]
+		candidates.append(containing if containing else [order[-1]])
+	return order,candidates
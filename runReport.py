@@ -0,0 +1,286 @@
+#!/usr/bin/python
+"""
+Run report of the BRIFS verification: timing, I/O and cache instrumentation.
+
+The calls
+
+with report.stage('readROMS'):
+	...
+report.read(source,variable,values)
+report.count('obsCache','hit')
+filename = report.write(plotdir,strdate,operMode)
+
+record, for the run of this process, the wall and CPU time (including finished
+worker processes) and the resident memory of every stage, the bytes and
+variables read from every netCDF file or URL, and the hits and misses of the
+caches (observation cache, grid indices, dataset registry). Every item mapped
+by concurrentFetch.processMap (one observation file, WRF file, date or figure)
+is timed as well, and the records of pool workers are returned to and merged
+into the report of the calling process, so the report covers the whole run.
+
+Records are tagged with the date being verified (report.setDate); write saves
+the records of one date and those shared by all dates of the run (e.g. WRF
+files extracted once for a backfill block) as JSON to
+plotdir/runReport_<date>_<mode>.json, and POSTs it to metricsURL if set.
+
+Bytes are those of the decoded arrays returned by netCDF4, which is what an
+OpenDAP server sends for uncompressed variables. Memory is measured per stage and
+per item: startMB is the resident size of the process at the start, stagePeakMB
+the highest resident size reached during the stage (the kernel high-water mark
+VmHWM, reset at the start of the stage through /proc/self/clear_refs), stageMB
+their difference and workersPeakMB the highest stagePeakMB of the items run by
+pool workers during the stage. The memory fields are None where /proc is missing.
+
+INPUT:
+--source: netCDF file name or URL
+--variable: variable read from source
+--values: array read (its nbytes are counted) or number of bytes
+--plotdir,strdate,operMode: as in performBRIFSverification.py
+
+OUTPUT:
+--filename: JSON run report with run, stages, items, io and caches sections
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import os,json,time,socket,resource,threading
+from contextlib import contextmanager
+import numpy as np
+
+# local metrics endpoint receiving every run report (HTTP POST of the JSON), e.g.
+# 'http://localhost:9091/brifs'; None disables it:
+metricsURL = None
+
+# timeout [s] of the POST to metricsURL:
+metricsTimeout = 5
+
+def cpuSeconds():
+	# CPU time of this process and of its terminated workers:
+	self = resource.getrusage(resource.RUSAGE_SELF)
+	children = resource.getrusage(resource.RUSAGE_CHILDREN)
+	return self.ru_utime+self.ru_stime+children.ru_utime+children.ru_stime
+
+def statusKB(field):
+	# field (VmRSS, VmHWM) of /proc/self/status [kB]; None without /proc:
+	try:
+		with open('/proc/self/status') as fp:
+			for line in fp:
+				if line.startswith(field+':'):
+					return int(line.split()[1])
+	except IOError:
+		pass
+	return None
+
+def resetHighWater():
+	# reset the high-water mark VmHWM of this process to its current resident size:
+	try:
+		with open('/proc/self/clear_refs','w') as fp:
+			fp.write('5')
+		return True
+	except IOError:
+		return False
+
+class memoryPeaks(object):
+	# resident memory of nested stages of this process. The high-water mark is reset
+	# at the start of every stage; the mark reached until then is first handed to the
+	# enclosing stages, so their peaks are not lost:
+	def __init__(self):
+		self.marks = []
+		self.processPeakKB = 0
+
+	def fold(self):
+		hwm = statusKB('VmHWM')
+		if hwm is None:
+			return
+		for mark in self.marks:
+			mark[1] = max(mark[1],hwm)
+		self.processPeakKB = max(self.processPeakKB,hwm)
+
+	def start(self):
+		# open a stage at the current resident size:
+		self.fold()
+		rss = statusKB('VmRSS') if resetHighWater() else None
+		self.marks.append([rss,rss])
+
+	def stop(self):
+		# close the innermost stage; returns its start and peak resident size [MB]:
+		self.fold()
+		startKB,peakKB = self.marks.pop()
+		if startKB is None:
+			return None,None
+		return startKB/1024.,peakKB/1024.
+
+	def processPeakMB(self):
+		# peak resident memory of this process over the whole run:
+		self.fold()
+		return self.processPeakKB/1024. if self.processPeakKB else None
+
+def workersPeakMB(items):
+	# highest peak of the items (records of report.items) run by pool workers:
+	peaks = [item['peakMB'] for item in items if item['pid']!=os.getpid() and item['peakMB'] is not None]
+	return max(peaks) if peaks else None
+
+def memoryFields(startMB,peakMB,items):
+	# memory fields of a stage record:
+	return {'startMB':startMB,'stagePeakMB':peakMB,'stageMB':peakMB-startMB if startMB is not None else None,\
+	'workersPeakMB':workersPeakMB(items)}
+
+def itemLabel(item):
+	# short name of a processMap item: figure name, file name or date of the task:
+	if isinstance(item,dict) and 'pngname' in item:
+		return os.path.basename(item['pngname'])
+	if isinstance(item,tuple) and item:
+		item = item[0]
+	return str(item)
+
+class runReport(object):
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self,date=None):
+		# forget all records (a pool worker starts every task afresh):
+		self.date = date
+		self.started = time.time()
+		self.stages = []
+		self.items = []
+		self.reads = {}
+		self.counters = {}
+
+	def setDate(self,date):
+		# tag the following records with date (None: shared by all dates of the run):
+		self.date = date
+
+	@contextmanager
+	def stage(self,name):
+		# time the enclosed block as stage name and measure its memory:
+		wall0 = time.time()
+		cpu0 = cpuSeconds()
+		nitems = len(self.items)
+		memory.start()
+		try:
+			yield
+		finally:
+			startMB,peakMB = memory.stop()
+			entry = {'stage':name,'date':self.date,'pid':os.getpid(),\
+			'wall':time.time()-wall0,'cpu':cpuSeconds()-cpu0}
+			entry.update(memoryFields(startMB,peakMB,self.items[nitems:]))
+			self.stages.append(entry)
+
+	def call(self,func,item):
+		# func(item), timed as one item of the stage func.__name__:
+		wall0 = time.time()
+		cpu0 = cpuSeconds()
+		memory.start()
+		try:
+			result = func(item)
+		finally:
+			startMB,peakMB = memory.stop()
+		self.items.append({'stage':func.__name__,'item':itemLabel(item),'date':self.date,'pid':os.getpid(),\
+		'wall':time.time()-wall0,'cpu':cpuSeconds()-cpu0,'startMB':startMB,'peakMB':peakMB})
+		return result
+
+	def read(self,source,variable,values):
+		# count the bytes of values (array or number of bytes) read as variable from source:
+		nbytes = values if isinstance(values,(int,long)) else np.asarray(values).nbytes
+		with self.lock:
+			entry = self.reads.setdefault((self.date,str(source)),{'bytes':0,'reads':0,'variables':set()})
+			entry['bytes'] += int(nbytes)
+			entry['reads'] += 1
+			entry['variables'].add(variable)
+
+	def count(self,cache,outcome):
+		# count one lookup of cache with outcome (hit, miss, ...):
+		with self.lock:
+			key = (self.date,cache,outcome)
+			self.counters[key] = self.counters.get(key,0)+1
+
+	def drain(self):
+		# records of this process, for merging into the report of the parent process:
+		records = (self.stages,self.items,self.reads,self.counters)
+		self.reset(self.date)
+		return records
+
+	def merge(self,records):
+		# add records drained from a worker process:
+		stages,items,reads,counters = records
+		with self.lock:
+			self.stages.extend(stages)
+			self.items.extend(items)
+			for key,entry in reads.items():
+				mine = self.reads.setdefault(key,{'bytes':0,'reads':0,'variables':set()})
+				mine['bytes'] += entry['bytes']
+				mine['reads'] += entry['reads']
+				mine['variables'] |= entry['variables']
+			for key,n in counters.items():
+				self.counters[key] = self.counters.get(key,0)+n
+
+	def summary(self,date=None,operMode=None):
+		# report of the records of date and of those shared by all dates (all records
+		# if date is None) as a JSON-serializable dict:
+		selected = lambda recordDate: date is None or recordDate in (date,None)
+		io = {}
+		for (recordDate,source),entry in sorted(self.reads.items()):
+			if selected(recordDate):
+				mine = io.setdefault(source,{'bytes':0,'reads':0,'variables':[]})
+				mine['bytes'] += entry['bytes']
+				mine['reads'] += entry['reads']
+				mine['variables'] = sorted(set(mine['variables'])|entry['variables'])
+		caches = {}
+		for (recordDate,cache,outcome),n in sorted(self.counters.items()):
+			if selected(recordDate):
+				counts = caches.setdefault(cache,{})
+				counts[outcome] = counts.get(outcome,0)+n
+		for cache,counts in caches.items():
+			total = sum(counts.values())
+			counts['hitRate'] = float(counts.get('hit',0))/total if total else None
+		return {'run':{'date':date,'mode':operMode,'host':socket.gethostname(),\
+		'started':time.strftime('%Y-%m-%dT%H:%M:%S',time.localtime(self.started)),\
+		'wall':time.time()-self.started,'cpu':cpuSeconds(),'peakMB':memory.processPeakMB(),\
+		'workersPeakMB':workersPeakMB([entry for entry in self.items if selected(entry['date'])]),\
+		'bytesRead':sum([entry['bytes'] for entry in io.values()])},\
+		'stages':[dict(entry,shared=entry['date'] is None) for entry in self.stages if selected(entry['date'])],\
+		'items':[entry for entry in self.items if selected(entry['date'])],\
+		'io':io,'caches':caches}
+
+	def write(self,plotdir,date=None,operMode=None):
+		# write the report of date to plotdir (and send it to metricsURL):
+		summary = self.summary(date,operMode)
+		filename = os.path.join(plotdir,'runReport_'+str(date)+'_'+str(operMode)+'.json')
+		# (per-process temporary file: concurrent drivers may write the same report):
+		tmp = filename+'.tmp%d' % os.getpid()
+		with open(tmp,'w') as fp:
+			json.dump(summary,fp,indent=1,sort_keys=True)
+		os.rename(tmp,filename)
+		if metricsURL:
+			postReport(summary)
+		return filename
+
+def postReport(summary):
+	# send the report to the metrics endpoint; a failing endpoint never fails the run:
+	import requests
+	try:
+		requests.post(metricsURL,data=json.dumps(summary),headers={'Content-Type':'application/json'},\
+		timeout=metricsTimeout)
+	except requests.exceptions.RequestException as e:
+		print "runReport: could not send the run report to ",metricsURL,": ",e
+
+def collectCall(task):
+	# run one processMap item in a pool worker and return its result with the
+	# worker's records and the error of a failed item (None if it succeeded); task
+	# is a tuple (func,item,date). A failing item (exception or sys.exit) must not
+	# kill the worker, which would leave the pool waiting for it:
+	func,item,date = task
+	report.reset(date)
+	try:
+		result,error = report.call(func,item),None
+	except (Exception,SystemExit) as e:
+		result,error = None,'%s: %s' % (type(e).__name__,e)
+		report.count(func.__name__,'failed')
+	return result,report.drain(),error
+
+# resident memory of the stages of this process:
+memory = memoryPeaks()
+
+# report of the current run:
+report = runReport()
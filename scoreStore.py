@@ -0,0 +1,152 @@
+#!/usr/bin/python
+"""
+Persistent store of the daily verification scores (SQLite).
+
+The calls
+
+store = scoreStore(dbfile)
+store.append(strdate,operMode,stations,sensorType,stats)
+dates,values = store.query(station,variable,score,startdate,enddate,operMode,sensorType)
+acc = store.skill(station,variable,startdate,enddate,operMode,sensorType)
+
+append the scores computed by basicStatistics for one date to the store (scores
+of a date that is verified again are replaced) and return the time series of one
+score at one station, e.g. the SLEV RMSE at ciutadella over the last 90 days:
+
+dates,rmse = scoreStore(dbfile).query('ciutadella','SLEV','RMSE',datetime.now()-timedelta(days=90))
+
+The skill accumulators of each date (see skillAccumulator.py) are stored as
+well, and skill combines them to the exact BIAS, RMSE and CORR of all pairs of
+a date range (acc.bias(), acc.rmse(), acc.corr()). Scores and accumulators are
+indexed by station, variable, mode and date.
+
+INPUT:
+--dbfile: SQLite database file (created if it does not exist)
+--strdate,operMode,stations,sensorType,stats: as in basicStatistics and plotBRIFS
+--station,variable,score: station location, observed variable (AIR_PRE, SLEV,
+	WTR_PRE) and score (BIAS, RMSE, CORR, N, COVERAGE)
+--startdate,enddate,operMode,sensorType: (optional) limits of the query
+
+OUTPUT:
+--dates: datetime64[D] array of the verified dates
+--values: float array of the score at these dates (NaN where not computed)
+--acc: skillAccumulator of the date range
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import os,sqlite3
+from datetime import datetime
+import numpy as np
+from skillAccumulator import *
+
+# observed variables and scores kept in the store (see basicStatistics.scores):
+storeVariables = ['AIR_PRE','SLEV','WTR_PRE']
+storeScores = ['BIAS','RMSE','CORR','N','COVERAGE']
+
+# seconds to wait for a lock held by another process writing the store:
+lockTimeout = 60
+
+class scoreStore(object):
+	def __init__(self,dbfile):
+		self.dbfile = dbfile
+		dirname = os.path.dirname(self.dbfile)
+		if dirname and not os.path.isdir(dirname):
+			os.makedirs(dirname)
+		con = self.connect()
+		with con:
+			con.execute('CREATE TABLE IF NOT EXISTS scores (date TEXT, mode TEXT, station TEXT, '\
+			'sensorType TEXT, variable TEXT, '+', '.join([score+' REAL' for score in storeScores])+', '\
+			'PRIMARY KEY (date,mode,station,sensorType,variable))')
+			con.execute('CREATE INDEX IF NOT EXISTS scoresByStation ON scores (station,variable,mode,date)')
+			con.execute('CREATE TABLE IF NOT EXISTS accumulators (date TEXT, mode TEXT, station TEXT, '\
+			'sensorType TEXT, variable TEXT, '+', '.join([field+' REAL' for field in accumulatorFields])+', '\
+			'PRIMARY KEY (date,mode,station,sensorType,variable))')
+			con.execute('CREATE INDEX IF NOT EXISTS accumulatorsByStation ON accumulators (station,variable,mode,date)')
+		con.close()
+
+	def connect(self):
+		return sqlite3.connect(self.dbfile,timeout=lockTimeout)
+
+	def append(self,strdate,operMode,stations,sensorType,stats):
+		# add (or replace) the scores of all stations for date strdate:
+		date = datetime.strftime(datetime.strptime(strdate,'%Y%m%d'),'%Y-%m-%d')
+		rows = []
+		accRows = []
+		for k,station in enumerate(stations):
+			for variable in storeVariables:
+				key = (date,operMode,station.location,sensorType[k],variable)
+				values = [scoreValue(stats[k],variable+'_'+score) for score in storeScores]
+				# skip variables without any score at this station:
+				if all([value is None for value in values]):
+					continue
+				rows.append(key+tuple(values))
+				acc = getattr(stats[k],variable+'_ACC',None)
+				if acc is not None:
+					accRows.append(key+tuple([float(getattr(acc,field)) for field in accumulatorFields]))
+		con = self.connect()
+		with con:
+			con.executemany('INSERT OR REPLACE INTO scores VALUES ('+','.join(['?']*(5+len(storeScores)))+')',rows)
+			con.executemany('INSERT OR REPLACE INTO accumulators VALUES ('+','.join(['?']*(5+len(accumulatorFields)))+')',accRows)
+		con.close()
+		return len(rows)
+
+	def query(self,station,variable,score='RMSE',startdate=None,enddate=None,operMode=None,sensorType=None):
+		# time series of score of variable at station, ordered by date:
+		if score not in storeScores:
+			raise ValueError('scoreStore: unknown score '+str(score))
+		sql = 'SELECT date,'+score+' FROM scores WHERE station=? AND variable=?'
+		args = [station,variable]
+		for condition,value in [('mode=?',operMode),('sensorType=?',sensorType),\
+		('date>=?',dateString(startdate)),('date<=?',dateString(enddate))]:
+			if value is not None:
+				sql += ' AND '+condition
+				args.append(value)
+		con = self.connect()
+		rows = con.execute(sql+' ORDER BY date',args).fetchall()
+		con.close()
+		dates = np.array([row[0] for row in rows],dtype='datetime64[D]')
+		values = np.array([np.nan if row[1] is None else row[1] for row in rows],dtype=float)
+		return dates,values
+
+	def skill(self,station,variable,startdate=None,enddate=None,operMode=None,sensorType=None):
+		# skill accumulator of all pairs of variable at station in the date range, combined
+		# from the daily accumulators (bias(), rmse(), corr() of the whole range):
+		sql = 'SELECT '+','.join(accumulatorFields)+' FROM accumulators WHERE station=? AND variable=?'
+		args = [station,variable]
+		for condition,value in [('mode=?',operMode),('sensorType=?',sensorType),\
+		('date>=?',dateString(startdate)),('date<=?',dateString(enddate))]:
+			if value is not None:
+				sql += ' AND '+condition
+				args.append(value)
+		con = self.connect()
+		rows = con.execute(sql,args).fetchall()
+		con.close()
+		if not rows:
+			return skillAccumulator()
+		return combine([skillAccumulator(*row) for row in rows])
+
+	def stations(self,operMode=None):
+		# locations held in the store:
+		con = self.connect()
+		if operMode is None:
+			rows = con.execute('SELECT DISTINCT station FROM scores ORDER BY station').fetchall()
+		else:
+			rows = con.execute('SELECT DISTINCT station FROM scores WHERE mode=? ORDER BY station',(operMode,)).fetchall()
+		con.close()
+		return [str(row[0]) for row in rows]
+
+def scoreValue(stats,field):
+	# score as float, or None if it was not computed (empty array):
+	value = getattr(stats,field,None)
+	if value is None or np.size(value)==0:
+		return None
+	return float(value)
+
+def dateString(date):
+	# datetime, datetime64 or YYYYMMDD string to the date format of the store:
+	if date is None:
+		return None
+	if isinstance(date,str):
+		date = datetime.strptime(date,'%Y%m%d')
+	return str(np.datetime64(date,'D'))
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+"""
+Memory-mapped cache of the model series extracted at the stations.
+
+The calls
+
+cache = seriesCache(cachedir,maxSizeMB)
+series = cache.load(source,stations,kind,fields)
+series = cache.save(source,stations,kind,fields,series)
+
+keep the series extracted from a WRF or ROMS file at a set of stations (pressures
+or sea levels, their time axis and grid cells) as one .npy file per array, and
+load them memory-mapped, so re-running a date (e.g. after changing the plots or
+the statistics) reads no model file at all. An entry is keyed by the real path,
+modification time and size of the source file, the station set (locations and
+coordinates), the kind of extraction, its fields and the interpolation method;
+a changed file or station set is extracted again. When the cache grows beyond
+maxSizeMB the least recently used entries are removed.
+
+INPUT:
+--cachedir: directory for the cached series
+--maxSizeMB: size cap of the cache directory in MB
+--source: WRF or ROMS file the series were extracted from
+--stations: list of station objects (location, LON, LAT) of the extraction
+--kind: name of the extraction (e.g. 'wrf', 'roms')
+--fields: list of model fields of the extraction (part of the key)
+--series: dict of numpy arrays
+
+OUTPUT:
+--series: dict of read-only memory-mapped arrays (None if not cached)
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import os,json,shutil,hashlib
+import numpy as np
+from runReport import report
+
+# version of the entry layout (and of the extraction); entries of other versions are ignored:
+cacheVersion = 1
+
+class seriesCache(object):
+	def __init__(self,cachedir,maxSizeMB=2000):
+		self.cachedir = cachedir
+		self.maxSize = maxSizeMB*1024*1024
+		if not os.path.isdir(self.cachedir):
+			os.makedirs(self.cachedir)
+
+	def entryName(self,source,stations,kind,fields,method=None):
+		# entry directory of the extraction of source at stations:
+		stat = os.stat(source)
+		key = json.dumps([cacheVersion,os.path.realpath(source),stat.st_mtime,stat.st_size,kind,\
+		list(fields),method,[(str(station.location),float(station.LON),float(station.LAT)) for station in stations]])
+		return os.path.join(self.cachedir,'series_'+kind+'_'+hashlib.sha1(key).hexdigest())
+
+	def load(self,source,stations,kind,fields,method=None):
+		series = mapEntry(self.entryName(source,stations,kind,fields,method))
+		report.count('seriesCache','miss' if series is None else 'hit')
+		return series
+
+	def save(self,source,stations,kind,fields,series,method=None):
+		# store series and return them memory-mapped from the cache:
+		entry = self.entryName(source,stations,kind,fields,method)
+		tmp = entry+'.tmp%d' % os.getpid()
+		if os.path.isdir(tmp):
+			shutil.rmtree(tmp)
+		os.makedirs(tmp)
+		for name,values in series.items():
+			np.save(os.path.join(tmp,name+'.npy'),np.asarray(values))
+		with open(os.path.join(tmp,'names.json'),'w') as fp:
+			json.dump(sorted(series),fp)
+		if os.path.isdir(entry):
+			shutil.rmtree(entry,ignore_errors=True)
+		try:
+			os.rename(tmp,entry)
+		except OSError:
+			# stored concurrently by another process:
+			shutil.rmtree(tmp,ignore_errors=True)
+		self.evict(keep=entry)
+		return mapEntry(entry) or series
+
+	def evict(self,keep=None):
+		# remove least recently used entries until the cache fits into maxSize:
+		entries = []
+		total = 0
+		for name in os.listdir(self.cachedir):
+			path = os.path.join(self.cachedir,name)
+			if not name.startswith('series_') or '.tmp' in name or not os.path.isdir(path):
+				continue
+			try:
+				size = sum([os.path.getsize(os.path.join(path,f)) for f in os.listdir(path)])
+			except OSError:
+				# removed concurrently:
+				continue
+			total += size
+			if path!=keep:
+				entries.append((os.path.getmtime(path),size,path))
+		for mtime,size,path in sorted(entries):
+			if total<=self.maxSize:
+				break
+			shutil.rmtree(path,ignore_errors=True)
+			total -= size
+
+def mapEntry(entry):
+	# arrays of an entry directory, memory-mapped (None if there is no complete entry):
+	try:
+		with open(os.path.join(entry,'names.json')) as fp:
+			names = json.load(fp)
+		series = dict([(str(name),np.load(os.path.join(entry,name+'.npy'),mmap_mode='r')) for name in names])
+		# mark as recently used:
+		os.utime(entry,None)
+	except (IOError,OSError,ValueError):
+		return None
+	return series
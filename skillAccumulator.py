@@ -0,0 +1,120 @@
+#!/usr/bin/python
+"""
+Mergeable accumulators of long-term model skill (BIAS, RMSE, CORR).
+
+The calls
+
+acc = skillAccumulator.fromSeries(obs,model)
+acc = acc.merge(other)
+acc = acc.update(obs,model)
+acc = combine(accumulators)
+bias,rmse,corr = acc.bias(),acc.rmse(),acc.corr()
+
+keep the sufficient statistics of pairs of observed and model values: the number
+of pairs n, the means of both series, their sums of squared deviations M2O, M2M
+and their co-moment COM. They are computed per series in two passes and combined
+with the pairwise update of Welford/Chan et al., so accumulators of any set of
+days (or of parallel backfill workers) combine to the exact scores of the pooled
+pairs, without reading the series again. All fields are arrays, one element per
+station (or scalars for a single station), so stations are accumulated at once.
+
+INPUT:
+--obs,model: (nstations,ntimes) arrays of aligned observed and model values; only
+	pairs valid in both are accumulated
+
+OUTPUT:
+--acc: skillAccumulator object
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import warnings
+import numpy as np
+
+# sufficient statistics of an accumulator:
+accumulatorFields = ['n','meanO','meanM','M2O','M2M','COM']
+
+class skillAccumulator(object):
+	__slots__ = accumulatorFields
+	def __init__(self,n=0.,meanO=0.,meanM=0.,M2O=0.,M2M=0.,COM=0.):
+		self.n = np.asarray(n,dtype=float)
+		self.meanO = np.asarray(meanO,dtype=float)
+		self.meanM = np.asarray(meanM,dtype=float)
+		self.M2O = np.asarray(M2O,dtype=float)
+		self.M2M = np.asarray(M2M,dtype=float)
+		self.COM = np.asarray(COM,dtype=float)
+
+	@classmethod
+	def fromSeries(cls,obs,model):
+		# accumulate the pairs of each row of obs and model valid in both:
+		obs = np.atleast_2d(np.asarray(obs,dtype=float))
+		model = np.atleast_2d(np.asarray(model,dtype=float))
+		valid = ~np.isnan(obs) & ~np.isnan(model)
+		n = np.sum(valid,axis=1).astype(float)
+		with np.errstate(invalid='ignore',divide='ignore'):
+			meanO = np.where(n>0,np.sum(np.where(valid,obs,0.),axis=1)/n,0.)
+			meanM = np.where(n>0,np.sum(np.where(valid,model,0.),axis=1)/n,0.)
+		dO = np.where(valid,obs-meanO[:,None],0.)
+		dM = np.where(valid,model-meanM[:,None],0.)
+		return cls(n,meanO,meanM,np.sum(dO**2,axis=1),np.sum(dM**2,axis=1),np.sum(dO*dM,axis=1))
+
+	@classmethod
+	def empty(cls,nstations):
+		# accumulator of nstations stations without pairs:
+		return cls(*[np.zeros(nstations) for field in accumulatorFields])
+
+	def update(self,obs,model):
+		# accumulator with the pairs of obs and model (rows = stations) added:
+		return self.merge(skillAccumulator.fromSeries(obs,model))
+
+	def __getitem__(self,k):
+		# accumulator of station(s) k:
+		return skillAccumulator(*[getattr(self,field)[k] for field in accumulatorFields])
+
+	def __getstate__(self):
+		return tuple([getattr(self,field) for field in accumulatorFields])
+
+	def __setstate__(self,state):
+		for field,value in zip(accumulatorFields,state):
+			setattr(self,field,value)
+
+	def merge(self,other):
+		# accumulator of the pairs of both accumulators (Chan et al. pairwise update):
+		return combine([self,other])
+
+	def bias(self):
+		# mean of obs-model:
+		return self.scores()[0]
+
+	def rmse(self):
+		return self.scores()[1]
+
+	def corr(self):
+		return self.scores()[2]
+
+	def scores(self):
+		# BIAS, RMSE and CORR of the accumulated pairs (NaN where there are none):
+		with np.errstate(invalid='ignore',divide='ignore'):
+			empty = self.n==0
+			bias = np.where(empty,np.nan,self.meanO-self.meanM)
+			msd = bias**2+(self.M2O+self.M2M-2*self.COM)/self.n
+			rmse = np.sqrt(np.maximum(msd,0.))
+			corr = self.COM/np.sqrt(self.M2O*self.M2M)
+		return bias,rmse,np.where(empty,np.nan,corr)
+
+def combine(accumulators):
+	# combine any number of accumulators (of equal shape) in one step:
+	fields = dict([(field,np.array([getattr(acc,field) for acc in accumulators],dtype=float)) \
+	for field in accumulatorFields])
+	n = np.sum(fields['n'],axis=0)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore',RuntimeWarning)
+		with np.errstate(invalid='ignore',divide='ignore'):
+			meanO = np.where(n>0,np.sum(fields['n']*fields['meanO'],axis=0)/n,0.)
+			meanM = np.where(n>0,np.sum(fields['n']*fields['meanM'],axis=0)/n,0.)
+	dO = fields['meanO']-meanO
+	dM = fields['meanM']-meanM
+	M2O = np.sum(fields['M2O']+fields['n']*dO**2,axis=0)
+	M2M = np.sum(fields['M2M']+fields['n']*dM**2,axis=0)
+	COM = np.sum(fields['COM']+fields['n']*dO*dM,axis=0)
+	return skillAccumulator(n,meanO,meanM,M2O,M2M,COM)
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+"""
+Batched spectral verification (Welch) in the rissaga band.
+
+The calls
+
+spec = spectralAccumulator.fromSeries(obs,model)
+spec = spec.merge(other)
+energyRatio,peakError,coherence = spec.scores()
+
+estimate the power spectra of the observed and model series and their cross
+spectrum with Welch's method (Hann-windowed segments of segmentMinutes with 50%
+overlap, mean removed per segment), for all stations at once: the segments of all
+rows are one 3-D array and are transformed in a single FFT. Only segments valid in
+both series are used, so gaps and the edges of a streamed window drop segments
+instead of biasing the spectra. The accumulator keeps the sums of the segment
+spectra and the number of segments, so accumulators of any set of days merge to
+the Welch estimate of the pooled segments (e.g. of a season of 1-minute records).
+
+Scores in the rissaga band (periods rissagaPeriods):
+--ENERGYRATIO: band-integrated model energy over observed energy
+--PEAKERROR: period of the model spectral peak minus that of the observed peak [min]
+--COHERENCE: mean magnitude squared coherence of model and observations
+
+INPUT:
+--obs,model: (nstations,nminutes) arrays of aligned observed and model values on a
+	1-minute axis (see basicStatistics.py)
+
+OUTPUT:
+--spec: spectralAccumulator object
+--energyRatio,peakError,coherence: arrays of scores, one per station (NaN where
+	there is no valid segment)
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import numpy as np
+from scipy.signal import get_window
+
+# length [min] of the Welch segments of the 1-minute series:
+segmentMinutes = 256
+
+# shortest and longest period [min] of the rissaga band:
+rissagaPeriods = (2.,60.)
+
+# fraction of the energy of a series below which its band is considered empty:
+flatEnergy = 1.e-12
+
+# fields of an accumulator (sums of the segment spectra and number of segments):
+spectralFields = ['n','Pxx','Pyy','Pxy']
+
+class spectralAccumulator(object):
+	__slots__ = spectralFields
+	def __init__(self,n,Pxx,Pyy,Pxy):
+		self.n = np.asarray(n,dtype=float)
+		self.Pxx = np.asarray(Pxx,dtype=float)
+		self.Pyy = np.asarray(Pyy,dtype=float)
+		self.Pxy = np.asarray(Pxy,dtype=complex)
+
+	@classmethod
+	def fromSeries(cls,obs,model,nperseg=segmentMinutes):
+		# segment spectra of each row of obs and model (segments valid in both only):
+		obs = np.atleast_2d(np.asarray(obs,dtype=float))
+		model = np.atleast_2d(np.asarray(model,dtype=float))
+		nrows,nminutes = obs.shape
+		nfreqs = nperseg//2+1
+		step = nperseg//2
+		nsegments = (nminutes-nperseg)//step+1 if nminutes>=nperseg else 0
+		if nsegments==0:
+			return cls(np.zeros(nrows),np.zeros((nrows,nfreqs)),np.zeros((nrows,nfreqs)),np.zeros((nrows,nfreqs)))
+		# (nrows,nsegments,nperseg) views of the segments:
+		columns = np.arange(nsegments)[:,None]*step+np.arange(nperseg)[None,:]
+		x = obs[:,columns]
+		y = model[:,columns]
+		valid = ~np.any(np.isnan(x),axis=2) & ~np.any(np.isnan(y),axis=2)
+		window = get_window('hann',nperseg)
+		x = np.where(valid[:,:,None],x,0.)
+		y = np.where(valid[:,:,None],y,0.)
+		x = (x-np.mean(x,axis=2)[:,:,None])*window
+		y = (y-np.mean(y,axis=2)[:,:,None])*window
+		X = np.fft.rfft(x,axis=2)
+		Y = np.fft.rfft(y,axis=2)
+		return cls(np.sum(valid,axis=1),np.sum(np.abs(X)**2,axis=1),np.sum(np.abs(Y)**2,axis=1),\
+		np.sum(np.conj(X)*Y,axis=1))
+
+	def __getitem__(self,k):
+		# accumulator of station(s) k:
+		return spectralAccumulator(*[getattr(self,field)[k] for field in spectralFields])
+
+	def __getstate__(self):
+		return tuple([getattr(self,field) for field in spectralFields])
+
+	def __setstate__(self,state):
+		for field,value in zip(spectralFields,state):
+			setattr(self,field,value)
+
+	def merge(self,other):
+		# accumulator of the segments of both accumulators:
+		return spectralAccumulator(*[getattr(self,field)+getattr(other,field) for field in spectralFields])
+
+	def periods(self):
+		# periods [min] of the frequencies of the segment spectra (inf for the mean):
+		frequencies = np.fft.rfftfreq(2*(np.shape(self.Pxx)[-1]-1),d=1.)
+		with np.errstate(divide='ignore'):
+			return 1./frequencies
+
+	def scores(self):
+		# ENERGYRATIO, PEAKERROR and COHERENCE in the rissaga band (NaN without segments):
+		periods = self.periods()
+		band = (periods>=rissagaPeriods[0]) & (periods<=rissagaPeriods[1])
+		Pxx = self.Pxx[...,band]
+		Pyy = self.Pyy[...,band]
+		Pxy = self.Pxy[...,band]
+		empty = self.n==0
+		# series without energy in the band (e.g. a smooth model) have no spectral peak:
+		noPeak = (np.sum(Pxx,axis=-1)<=flatEnergy*np.sum(self.Pxx,axis=-1)) | \
+		(np.sum(Pyy,axis=-1)<=flatEnergy*np.sum(self.Pyy,axis=-1))
+		# (one-sided spectra: the Nyquist frequency is counted once, the others twice):
+		weights = np.where(periods[band]==2.,1.,2.)
+		with np.errstate(invalid='ignore',divide='ignore'):
+			energyRatio = np.sum(weights*Pyy,axis=-1)/np.sum(weights*Pxx,axis=-1)
+			peakError = periods[band][np.argmax(Pyy,axis=-1)]-periods[band][np.argmax(Pxx,axis=-1)]
+			coherence = np.mean(np.abs(Pxy)**2/(Pxx*Pyy),axis=-1)
+		return np.where(empty,np.nan,energyRatio),np.where(empty | noPeak,np.nan,peakError),np.where(empty,np.nan,coherence)
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+"""
+Generates synthetic WRF, ROMS and SOCIB L1 mooring netCDF files with the layout of
+the BRIFS archive and the SOCIB THREDDS server, for benchmarks without access to
+either (see benchmarkBRIFS.py).
+
+The call
+
+fixture = syntheticData(rootdir,strdate,nstations,wrfShape,romsShape,childShape,windowHours).write()
+
+writes, below rootdir:
+--WRF/<date>_op/wrfout_d02_<day>_12:00:00: hourly WRF files (XLONG, XLAT, XTIME, Times,
+	PSFC, HGT, T2, Q2, U10, V10) for yesterday, today and tomorrow of each date.
+	Run directories of later dates link the files of the first one.
+--ROMS/roms_BRIFS_parent|child_<date>_his.nc: 5-minute ROMS parent and child
+	(around ciutadella) files (lon_rho, lat_rho, mask_rho, h, ocean_time, zeta)
+--www/thredds/dodsC/mooring/<kind>/station_<name>-<sensor>/L1/<year>/...: monthly
+	1-minute L1 station files (time, LON, LAT, HEIGHT, SLEV, AIR_PRE, WTR_PRE and
+	QC flags) with empty .dds companions, to be served by a local HTTP stand-in
+	server from www/ (writeDiscovery writes the DataDiscovery list-platforms answer)
+
+INPUT:
+--rootdir: output directory
+--strdate: first verification date YYYYMMDD
+--nstations: number of stations (the first one is ciutadella, read from ROMS child)
+--wrfShape,romsShape,childShape: (ny,nx) of the WRF, ROMS parent and ROMS child grids
+--windowHours: length of the ROMS output and observation window [hours]
+--ndays: (optional) number of verification dates
+
+OUTPUT:
+--fixture: dict with wrfdirs (run directory of each date), romsdir, wwwdir, fileList (local paths of
+	the station files) and stations (name,lon,lat) list
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import os,json
+from datetime import datetime,timedelta
+import numpy as np
+from netCDF4 import Dataset
+
+# model domains [lon0,lon1,lat0,lat1]:
+wrfDomain = [0.5,5.5,38.0,41.5]
+romsDomain = [1.0,5.0,38.6,41.0]
+# ROMS child domain around ciutadella:
+childDomain = [3.78,3.89,39.96,40.03]
+ciutadella = (3.835,39.998)
+
+# station kinds and sensors (directory, sensor name):
+sensorKinds = [('barometer','scb-baro005'),('weather_station','scb-met005'),('sea_level','scb-sensor')]
+
+class syntheticData(object):
+	def __init__(self,rootdir,strdate,nstations=10,wrfShape=(120,150),romsShape=(200,200),\
+	childShape=(60,60),windowHours=48,ndays=1):
+		self.rootdir = rootdir
+		self.startdatenum = datetime.strptime(strdate,'%Y%m%d')
+		self.nstations = nstations
+		self.wrfShape = wrfShape
+		self.romsShape = romsShape
+		self.childShape = childShape
+		self.windowHours = windowHours
+		self.ndays = ndays
+		self.wrfroot = os.path.join(rootdir,'WRF')
+		self.romsdir = os.path.join(rootdir,'ROMS')+'/'
+		self.wwwdir = os.path.join(rootdir,'www')
+		self.random = np.random.RandomState(0)
+
+	def stations(self):
+		# ciutadella (on the ROMS child grid) and stations spread over the ROMS parent domain:
+		stations = [('ciutadella',)+ciutadella]
+		lons = self.random.uniform(romsDomain[0]+0.2,romsDomain[1]-0.2,self.nstations-1)
+		lats = self.random.uniform(romsDomain[2]+0.2,romsDomain[3]-0.2,self.nstations-1)
+		for k in range(self.nstations-1):
+			stations.append(('station%03d' % k,lons[k],lats[k]))
+		return stations[:self.nstations]
+
+	def write(self):
+		dates = [self.startdatenum+timedelta(days=k) for k in range(self.ndays)]
+		stations = self.stations()
+
+		# WRF: the files of all days are written once, and every run directory links them:
+		wrfdays = sorted(set([date+timedelta(days=k) for date in dates for k in [-1,0,1]]))
+		wrfdirs = {}
+		for day in wrfdays:
+			writeWRF(os.path.join(self.wrfroot,'files'),day,self.wrfShape)
+		for date in dates:
+			wrfdir = os.path.join(self.wrfroot,datetime.strftime(date,'%Y%m%d')+'_op')+'/'
+			makedirs(wrfdir)
+			for day in wrfdays:
+				name = 'wrfout_d02_'+datetime.strftime(day,'%Y-%m-%d_12:00:00')
+				if not os.path.exists(wrfdir+name):
+					os.symlink(os.path.join(self.wrfroot,'files',name),wrfdir+name)
+			wrfdirs[datetime.strftime(date,'%Y%m%d')] = wrfdir
+
+		# ROMS parent and child of each date:
+		makedirs(self.romsdir)
+		for date in dates:
+			writeROMS(self.romsdir+'roms_BRIFS_parent_'+datetime.strftime(date,'%Y%m%d')+'_his.nc',\
+			date,romsDomain,self.romsShape,self.windowHours)
+			writeROMS(self.romsdir+'roms_BRIFS_child_'+datetime.strftime(date,'%Y%m%d')+'_his.nc',\
+			date,childDomain,self.childShape,self.windowHours)
+
+		# monthly station files covering the observation windows:
+		t0 = dates[0]-timedelta(days=1)
+		t1 = dates[-1]+timedelta(hours=max(self.windowHours,60))
+		months = sorted(set([(t0+timedelta(days=k)).replace(day=1,hour=0) for k in range((t1-t0).days+1)]))
+		fileList = []
+		for k,(name,lon,lat) in enumerate(stations):
+			kind,sensor = sensorKinds[k % len(sensorKinds)]
+			for month in months:
+				fileList.append(writeStation(self.wwwdir,name,lon,lat,kind,sensor,month))
+
+		return {'wrfdirs':wrfdirs,'romsdir':self.romsdir,'wwwdir':self.wwwdir,\
+		'fileList':fileList,'stations':stations}
+
+def makedirs(path):
+	if not os.path.isdir(path):
+		os.makedirs(path)
+
+def writeWRF(wrfdir,day,shape,ntimes=24):
+	# hourly WRF file of the forecast starting at 12 UTC of day:
+	makedirs(wrfdir)
+	ny,nx = shape
+	t0 = day.replace(hour=12)
+	filename = os.path.join(wrfdir,'wrfout_d02_'+datetime.strftime(t0,'%Y-%m-%d_%H:%M:%S'))
+	if os.path.isfile(filename):
+		return filename
+	lon = np.linspace(wrfDomain[0],wrfDomain[1],nx)[None,:]+0.01*np.linspace(0,1,ny)[:,None]
+	lat = np.linspace(wrfDomain[2],wrfDomain[3],ny)[:,None]+0.01*np.linspace(0,1,nx)[None,:]
+	f = Dataset(filename,'w')
+	f.createDimension('Time',None)
+	f.createDimension('DateStrLen',19)
+	f.createDimension('south_north',ny)
+	f.createDimension('west_east',nx)
+	times = [t0+timedelta(hours=h) for h in range(ntimes)]
+	f.createVariable('Times','S1',('Time','DateStrLen'))[:] = \
+	np.array([list(datetime.strftime(t,'%Y-%m-%d_%H:%M:%S')) for t in times])
+	xtime = f.createVariable('XTIME','f4',('Time',))
+	xtime.units = 'minutes since '+datetime.strftime(t0,'%Y-%m-%d %H:%M:%S')
+	xtime[:] = np.arange(ntimes)*60.
+	dims = ('Time','south_north','west_east')
+	hours = (t0-datetime(2000,1,1)).total_seconds()/3600.+np.arange(ntimes)
+	for h,t in enumerate(hours):
+		# write time step by time step, so large grids need little memory:
+		fields = {'XLONG':lon,'XLAT':lat,'HGT':10*(lon-wrfDomain[0]),\
+		'T2':290+np.sin(t/5.)+0*lon,'Q2':0.01+0*lon,\
+		'PSFC':101000+100*np.sin(t/7.)+10*lat,'U10':3+np.sin(t/11.)+0*lon,'V10':4+np.cos(t/3.)+0*lon}
+		for name in sorted(fields):
+			if h==0:
+				f.createVariable(name,'f4',dims)
+			f.variables[name][h] = fields[name]
+	f.close()
+	return filename
+
+def writeROMS(filename,date,domain,shape,windowHours):
+	# 5-minute ROMS output starting at 00 UTC of date:
+	ny,nx = shape
+	lon = domain[0]+(domain[1]-domain[0])*np.linspace(0,1,nx)[None,:]+np.zeros((ny,1))
+	lat = domain[2]+(domain[3]-domain[2])*np.linspace(0,1,ny)[:,None]+np.zeros((1,nx))
+	ntimes = windowHours*12+1
+	f = Dataset(filename,'w')
+	f.createDimension('ocean_time',None)
+	f.createDimension('eta_rho',ny)
+	f.createDimension('xi_rho',nx)
+	oceanTime = f.createVariable('ocean_time','f8',('ocean_time',))
+	oceanTime.units = 'seconds since 1968-05-23 00:00:00'
+	oceanTime[:] = (date-datetime(1968,5,23)).total_seconds()+np.arange(ntimes)*300.
+	for name,value in [('lon_rho',lon),('lat_rho',lat),('mask_rho',np.ones_like(lon)),('h',10+lon)]:
+		f.createVariable(name,'f8',('eta_rho','xi_rho'))[:] = value
+	zeta = f.createVariable('zeta','f4',('ocean_time','eta_rho','xi_rho'))
+	for k in range(ntimes):
+		# seiche-like oscillation (20 minute period, resolved by the 5-minute output) over a
+		# spatial gradient:
+		zeta[k] = 0.1*np.sin(2*np.pi*k*300/1200.)+0.01*lon
+	f.close()
+	return filename
+
+def writeStation(wwwdir,name,lon,lat,kind,sensor,month):
+	# monthly 1-minute L1 file of station name, as listed on the SOCIB THREDDS server:
+	dirname = os.path.join(wwwdir,'thredds','dodsC','mooring',kind,'station_'+name+'-'+sensor.replace('-','_'),'L1',month.strftime('%Y'))
+	makedirs(dirname)
+	filename = os.path.join(dirname,'dep0001_station-'+name+'_'+sensor+'_L1_'+month.strftime('%Y-%m')+'.nc')
+	nextMonth = (month.replace(day=28)+timedelta(days=4)).replace(day=1)
+	seconds = np.arange((month-datetime(1970,1,1)).total_seconds(),(nextMonth-datetime(1970,1,1)).total_seconds(),60.)
+	f = Dataset(filename,'w')
+	f.createDimension('time',None)
+	time = f.createVariable('time','f8',('time',))
+	time.units = 'seconds since 1970-01-01 00:00:00'
+	time[:] = seconds
+	for var,value in [('LON',lon),('LAT',lat),('HEIGHT',0.)]:
+		f.createVariable(var,'f8',())[:] = value
+	minutes = np.arange(len(seconds))
+	for var,value in [('SLEV',0.1*np.sin(2*np.pi*minutes/10.)),('AIR_PRE',1010+np.sin(minutes/420.)),\
+	('WTR_PRE',0.2*np.sin(2*np.pi*minutes/10.))]:
+		f.createVariable(var,'f4',('time',),fill_value=np.float32(9.96921e36))[:] = value
+		f.createVariable('QC_'+var,'i1',('time',))[:] = 1
+	f.close()
+	# empty DAP2 descriptor, answering the existence probes of the stand-in server:
+	open(filename+'.dds','w').close()
+	return filename
+
+def writeDiscovery(wwwdir,fileList,serverURL):
+	# DataDiscovery list-platforms answer listing the station files as URLs of the
+	# stand-in server serving wwwdir at serverURL:
+	platforms = [{'jsonInfo':{'opendapUrl':serverURL+os.path.relpath(filename,wwwdir)}} for filename in fileList]
+	with open(os.path.join(wwwdir,'list-platforms'),'w') as fp:
+		json.dump(platforms,fp)
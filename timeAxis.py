@@ -0,0 +1,57 @@
+#!/usr/bin/python
+"""
+Vectorized decoding of netCDF time axes to numpy.datetime64.
+
+The calls
+
+t = decodeTime(var,defaultUnits)
+t = decodeWRFTimes(f)
+
+decode a netCDF time variable (SOCIB time, ROMS ocean_time) or the time axis of a
+WRF file once per file to a datetime64[s] array, using the units attribute
+("<seconds|minutes|hours|days> since <date> [<time>]"). The whole pipeline
+carries these arrays, so no per-sample datetime/string conversion is needed.
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import re
+from datetime import datetime
+import numpy as np
+from netCDF4 import chartostring
+
+# seconds per time unit:
+unitSeconds = {'second':1,'minute':60,'hour':3600,'day':86400}
+
+def parseUnits(units):
+	# split units string into seconds per unit and reference date (datetime64[s]):
+	m = re.match(r'\s*(\w+?)s?\s+since\s+(\d{1,4})-(\d{1,2})-(\d{1,2})(?:[ T](\d{1,2}):(\d{1,2})(?::(\d{1,2}))?)?',units)
+	if not m or m.group(1).lower() not in unitSeconds:
+		raise ValueError('timeAxis: cannot parse time units: '+str(units))
+	reference = datetime(*[int(g) for g in m.groups()[1:] if g is not None])
+	return unitSeconds[m.group(1).lower()],np.datetime64(reference,'s')
+
+def decodeTimeValues(values,units):
+	# convert time values in units to datetime64[s]:
+	factor,reference = parseUnits(units)
+	seconds = np.round(np.array(values,dtype=float)*factor).astype('int64')
+	return reference+seconds.astype('timedelta64[s]')
+
+def decodeTime(var,defaultUnits=None):
+	# decode a netCDF time variable, falling back to defaultUnits if it has no units attribute:
+	units = getattr(var,'units',defaultUnits)
+	return decodeTimeValues(var[:],units)
+
+def decodeWRFTimes(f):
+	# WRF time axis from XTIME (minutes since simulation start) if present, else from the Times strings:
+	if 'XTIME' in f.variables and hasattr(f.variables['XTIME'],'units'):
+		try:
+			return decodeTime(f.variables['XTIME'])
+		except ValueError:
+			pass
+	t = np.char.replace(chartostring(f.variables['Times'][:]),'_','T')
+	return np.array(t,dtype='datetime64[s]')
+
+def toDatetime64(datenum):
+	# datetime to datetime64[s]:
+	return np.datetime64(datenum,'s')
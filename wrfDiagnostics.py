@@ -0,0 +1,88 @@
+#!/usr/bin/python
+"""
+Registry of the WRF diagnostics (derived variables) extracted at the stations.
+
+The calls
+
+outputs = diagnosticFields(wrfFields)
+cells = interp.read(f,rawInputs(outputs))
+values = evaluate(outputs,cells)
+
+select the registered diagnostics among the requested wrfFields (e.g. pointMSLP,
+pointPSFC, pointWSPD10), list the raw wrfout variables they depend on, so that
+only those are read, and evaluate them, each at most once and only if a requested
+output needs it, on whole (cells,ntimes) arrays of all stations at a time. A
+diagnostic may depend on raw variables and on other diagnostics. Adding one, e.g.
+a new station variable, only needs a register call below.
+
+INPUT:
+--wrfFields: list of the requested WRF fields (diagnostics are 'point' fields)
+--cells: dict of (ncells,ntimes) arrays of the raw variables (see gridInterpolation.read)
+
+OUTPUT:
+--outputs: list of the requested diagnostics
+--values: dict of (ncells,ntimes) arrays of the requested diagnostics
+
+Author: Matjaz Licer, NIB MBS @socib
+matjaz.licer@mbss.org
+"""
+import numpy as np
+
+# registered diagnostics, keyed by name:
+diagnostics = {}
+
+class diagnostic(object):
+	def __init__(self,name,inputs,func,units):
+		# inputs are raw wrfout variables or other diagnostics (names starting with 'point'),
+		# func computes the diagnostic from the arrays of its inputs, in that order:
+		self.name = name
+		self.inputs = inputs
+		self.func = func
+		self.units = units
+
+def register(name,inputs,func,units):
+	diagnostics[name] = diagnostic(name,inputs,func,units)
+
+def isDiagnostic(name):
+	return name.startswith('point') and name in diagnostics
+
+def diagnosticFields(wrfFields):
+	# the registered diagnostics among wrfFields:
+	return [field for field in wrfFields if field in diagnostics]
+
+def rawInputs(names):
+	# sorted raw wrfout variables needed to evaluate the diagnostics names:
+	raw = set()
+	for name in names:
+		for field in diagnostics[name].inputs:
+			if isDiagnostic(field):
+				raw.update(rawInputs([field]))
+			else:
+				raw.add(field)
+	return sorted(raw)
+
+def evaluate(names,cells):
+	# dict of the diagnostics names, computed from the raw arrays cells; diagnostics
+	# needed by several outputs are computed once:
+	values = {}
+	def value(field):
+		if not isDiagnostic(field):
+			return cells[field]
+		if field not in values:
+			values[field] = diagnostics[field].func(*[value(x) for x in diagnostics[field].inputs])
+		return values[field]
+	return dict([(name,value(name)) for name in names])
+
+# surface pressure [hPa]:
+register('pointPSFC',['PSFC'],lambda psfc: 1.e-2*psfc,'hPa')
+
+# mean sea level pressure [hPa], hypsometric reduction of the surface pressure with the
+# virtual temperature at 2 m:
+register('pointMSLP',['PSFC','HGT','T2','Q2'],\
+lambda psfc,hgt,t2,q2: 1.e-2*psfc*np.exp(9.81*hgt/(287*t2*(1+0.61*q2))),'hPa')
+
+# air temperature at 2 m [degC]:
+register('pointT2',['T2'],lambda t2: t2-273.15,'degC')
+
+# wind speed at 10 m [m/s] (U10 and V10 are given at the mass points):
+register('pointWSPD10',['U10','V10'],lambda u10,v10: np.hypot(u10,v10),'m/s')